@@ -0,0 +1,148 @@
+"""coverage grid module
+
+    Interpolated reception coverage for a transmitting station.
+
+    The quality reported by every receiving station is spread over a
+    regular grid covering the map extent with inverse distance weighting,
+    all grid cells and all receivers at once.  Grids are cached per
+    (station, frequency, date set) in memory and, optionally, on disk so
+    the site build and interactive views reuse them.
+
+"""
+import os
+import hashlib
+
+import numpy as np
+
+from net_dates import NetWindow, normalize_net_date, net_day
+
+
+def idw_grid(x, y, values, x_range, y_range, resolution=100, power=2, smoothing=0.0):
+    """inverse distance weighted interpolation of scattered values onto a regular grid
+
+    :param x: receiver x coordinates, web mercator meters
+    :param y: receiver y coordinates, web mercator meters
+    :param values: value at each receiver, nan entries are ignored
+    :param tuple x_range: (x_min, x_max) of the grid
+    :param tuple y_range: (y_min, y_max) of the grid
+    :param int resolution: number of grid cells along each axis
+    :param float power: distance exponent of the weights
+    :param float smoothing: meters added to every distance, > 0 flattens the peaks at the receivers
+    :return: 2D array shaped (resolution, resolution), rows run south to north, nan if there are no values
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    good = ~(np.isnan(x) | np.isnan(y) | np.isnan(values))
+    x, y, values = x[good], y[good], values[good]
+
+    if len(values) == 0:
+        return np.full((resolution, resolution), np.nan)
+
+    # cell centers
+    dx = (x_range[1] - x_range[0]) / resolution
+    dy = (y_range[1] - y_range[0]) / resolution
+    grid_x = x_range[0] + dx * (np.arange(resolution) + 0.5)
+    grid_y = y_range[0] + dy * (np.arange(resolution) + 0.5)
+    gx, gy = np.meshgrid(grid_x, grid_y)
+
+    distance = np.hypot(gx[..., None] - x, gy[..., None] - y) + smoothing
+    with np.errstate(divide='ignore'):
+        weights = 1.0 / distance ** power
+
+    # a cell sitting right on a receiver takes that receiver's value
+    exact = np.isinf(weights)
+    if exact.any():
+        weights = np.where(exact.any(axis=-1, keepdims=True), exact.astype(float), weights)
+
+    return (weights * values).sum(axis=-1) / weights.sum(axis=-1)
+
+
+def data_fingerprint(*arrays):
+    """short hash of the inputs of a grid, used to tell when a cached grid is stale"""
+    h = hashlib.sha1()
+    for a in arrays:
+        h.update(np.ascontiguousarray(np.asarray(a, dtype=float)).tobytes())
+
+    return h.hexdigest()
+
+
+class CoverageCache:
+    """
+    Coverage grids keyed by (station, frequency, date set), held in memory and optionally as .npz files.
+    """
+
+    def __init__(self, cache_dir=None):
+        """
+        :param str cache_dir: directory for .npz grid files, None to keep the grids in memory only
+        """
+        self.cache_dir = cache_dir
+        self.grids = {}
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(station, frequency, dates):
+        """cache key for one station, frequency and date set, None meaning all dates"""
+        if dates is None:
+            dates = ('all',)
+        elif isinstance(dates, (str, NetWindow)):
+            # a window is kept under its description, the data fingerprint catches nets coming into it
+            dates = (str(normalize_net_date(dates)),)
+        else:
+            dates = [normalize_net_date(d) for d in dates]
+
+        return station, float(frequency), tuple(sorted(dates))
+
+    def _file_name(self, key):
+        station, frequency, dates = key
+        # yyyymmdd for each date, so 11/7/2021 and 1/17/2021 stay apart, a hash for a window's description
+        parts = []
+        for net_date in dates:
+            day = net_day(net_date)
+            if day is not None:
+                parts.append(day.replace('-', ''))
+            elif net_date == 'all':
+                parts.append(net_date)
+            else:
+                parts.append(hashlib.sha1(net_date.encode()).hexdigest()[:12])
+        label = '-'.join(parts)
+        if len(label) > 40:
+            label = hashlib.sha1(label.encode()).hexdigest()[:16]
+
+        return os.path.join(self.cache_dir, f'coverage_{station}_{frequency:.3f}_{label}.npz')
+
+    def get(self, key, fingerprint):
+        """the cached grid for a key if it was made from the same data, otherwise None"""
+        if key in self.grids:
+            grid, cached_fingerprint = self.grids[key]
+            if cached_fingerprint == fingerprint:
+                return grid
+
+        if self.cache_dir is not None:
+            file_name = self._file_name(key)
+            if os.path.exists(file_name):
+                with np.load(file_name) as npz:
+                    if str(npz['fingerprint']) == fingerprint:
+                        grid = npz['grid']
+                        self.grids[key] = (grid, fingerprint)
+                        return grid
+
+        return None
+
+    def put(self, key, fingerprint, grid):
+        self.grids[key] = (grid, fingerprint)
+
+        if self.cache_dir is not None:
+            np.savez_compressed(self._file_name(key), grid=grid, fingerprint=np.array(fingerprint))
+
+    def clear(self):
+        """forget every grid, e.g. after the database was rebuilt"""
+        self.grids = {}
+
+        if self.cache_dir is not None:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.startswith('coverage_') and file_name.endswith('.npz'):
+                    os.remove(os.path.join(self.cache_dir, file_name))
@@ -0,0 +1,194 @@
+"""federation module
+
+    Several forms or clubs, one region.
+
+    Each source (a form, a club, a band) keeps its reports in its own
+    SQLite shard, an ordinary report database, so sources are ingested
+    independently and in parallel without contending for one file.  A
+    registry database holds the shared Hams table.  FederatedReportDatabase
+    opens the registry, attaches the shards and puts a temporary view named
+    RESPONSES in front of them, so every query of SimplexReportDatabase -
+    reception data, statistics, maps and the site builder - fans out over
+    all the shards and gets merged results.  The registry's own NET_METADATA
+    and NET_STATISTICS tables hold the merged metadata and rollups.  They
+    are redone only for the nets whose reports changed in some shard, found
+    by comparing a row count per source and net with the one recorded at
+    the last merge.
+
+    SQLite attaches at most 10 databases by default, which bounds the number
+    of shards one federated view can span.
+
+"""
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from simplex_net import SimplexReportDatabase
+
+
+def read_registry_stations(registry_filename):
+    """the shared Hams table as the list of dicts read_station_information_file gives"""
+    con = sqlite3.connect(registry_filename)
+    try:
+        rows = con.execute("SELECT Call, Latitude, Longitude FROM Hams ORDER BY Id").fetchall()
+    finally:
+        con.close()
+
+    return [{'Call': call, 'Latitude': latitude, 'Longitude': longitude} for call, latitude, longitude in rows]
+
+
+def ingest_source(shard_filename, registry_filename, form_data):
+    """add the new reports of one source to its shard, creating the shard if needed
+
+    Runs in a worker process when sources are ingested in parallel.
+
+    :param str shard_filename: the source's report database
+    :param str registry_filename: database holding the shared Hams table
+    :param list form_data: all rows of the source's form, header first
+    :return: set of (station, frequency, net date) touched
+    """
+    db = SimplexReportDatabase(shard_filename)
+    db.write_station_information(read_registry_stations(registry_filename))
+    db.read_all_base_station_information()
+
+    return db.append_new_reports(form_data)
+
+
+class FederatedReportDatabase(SimplexReportDatabase):
+    """
+    A read view over several per-source report databases sharing one station registry.
+    """
+    shards = None
+
+    def __init__(self, registry_filename, shards, station_locations_filename=None, coverage_cache_dir=None):
+        """
+        :param str registry_filename: database holding the shared Hams table
+        :param dict shards: source name -> shard database file name
+        :param str station_locations_filename: text file listing call sign, latitude and longitude,
+            given to (re)load the shared Hams table
+        :param str coverage_cache_dir: directory to keep coverage grids between runs, None for memory only
+        """
+        self.shards = dict(shards)
+
+        registry = SimplexReportDatabase(registry_filename, coverage_cache_dir=coverage_cache_dir)
+        if station_locations_filename is not None:
+            registry.write_station_information(registry.read_station_information_file(station_locations_filename))
+        registry.con.close()
+
+        # shards written by an older version get their tables brought up to date before they are merged
+        for shard_filename in self.shards.values():
+            if os.path.exists(shard_filename):
+                SimplexReportDatabase(shard_filename).con.close()
+
+        # the registry is opened again as the federated connection with the shards attached
+        super().__init__(registry_filename, coverage_cache_dir=coverage_cache_dir)
+        self.attach_shards()
+
+    def attach_shards(self):
+        """attach every shard, (re)build the view that merges them and bring the merged tables up to date"""
+        cur = self.con.cursor()
+        attached = set(row[1] for row in cur.execute("PRAGMA database_list"))
+
+        schemas = []
+        for source, shard_filename in sorted(self.shards.items()):
+            if not os.path.exists(shard_filename):
+                continue
+            schema = 'shard_' + re.sub(r'[^0-9A-Za-z_]', '_', source)
+            if schema not in attached:
+                cur.execute("ATTACH DATABASE ? AS " + schema, (shard_filename,))
+            schemas.append((source, schema))
+
+        cur.execute("DROP VIEW IF EXISTS temp.RESPONSES")
+
+        # the source name goes into the view as an SQL string literal
+        selects = [f"SELECT *, '{source.replace(chr(39), chr(39) * 2)}' AS Source FROM {schema}.RESPONSES"
+                   for source, schema in schemas]
+        if len(selects) > 0:
+            # a transmitter's power, height and location come from whichever source it reported through,
+            # looked up by primary key in the merged NET_METADATA of the registry
+            match = "m.TransmittingStation = r.TransmittingStation AND m.FrequencyOfNet = r.FrequencyOfNet " +\
+                    "AND m.DateOfNet = r.DateOfNet"
+            cur.execute("CREATE TEMP VIEW RESPONSES AS SELECT r.Id, r.ReportingTimestamp, r.ReportingStation, " +
+                        "r.DateOfNet, r.FrequencyOfNet, r.TransmittingStation, " +
+                        "COALESCE(m.Power, r.TransmittingStationPower) AS TransmittingStationPower, " +
+                        "COALESCE(m.Height, r.TransmittingStationHeight) AS TransmittingStationHeight, " +
+                        "COALESCE(m.Latitude, r.TransmittingStationLatitude) AS TransmittingStationLatitude, " +
+                        "COALESCE(m.Longitude, r.TransmittingStationLongitude) AS TransmittingStationLongitude, " +
+                        "r.ReceivingStation, r.QSOQuality, r.ReceivingStationHeight, " +
+                        "r.ReceivingStationLatitude, r.ReceivingStationLongitude, r.NetDay, r.Source " +
+                        "FROM (" + " UNION ALL ".join(selects) + f") r LEFT JOIN main.NET_METADATA m ON {match}")
+
+        self.merge_changed_nets(schemas)
+        self.relay_graph_cache = {}
+
+    def merge_changed_nets(self, schemas):
+        """redo the merged NET_METADATA and NET_STATISTICS of the nets whose reports changed in any shard
+
+        The registry keeps a row count and last rowid per source and net in FEDERATED_NETS to tell which
+        nets changed since the last merge, whether the shards were written by ingest() or another process.
+        :param list schemas: (source name, attached schema) of the shards
+        :return: set of (frequency, net date) merged again
+        """
+        cur = self.con.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS main.FEDERATED_NETS (Source TEXT, FrequencyOfNet FLOAT, " +
+                    "DateOfNet DATE, Rows INT, LastRowid INT, PRIMARY KEY (Source, FrequencyOfNet, DateOfNet))")
+
+        signatures = []
+        for source, schema in schemas:
+            signatures.extend((source,) + row for row in
+                              cur.execute("SELECT FrequencyOfNet, DateOfNet, COUNT(*), MAX(rowid) " +
+                                          f"FROM {schema}.RESPONSES GROUP BY FrequencyOfNet, DateOfNet"))
+        previous = set(cur.execute("SELECT * FROM main.FEDERATED_NETS"))
+        nets = set((frequency, net_date) for source, frequency, net_date, rows, last in previous ^ set(signatures))
+        if len(nets) == 0:
+            return nets
+
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS touched_nets (FrequencyOfNet FLOAT, DateOfNet DATE)")
+        cur.execute("DELETE FROM touched_nets")
+        cur.executemany("INSERT INTO touched_nets VALUES (?, ?)", sorted(nets))
+        cur.execute("DELETE FROM main.NET_METADATA WHERE (FrequencyOfNet, DateOfNet) IN " +
+                    "(SELECT FrequencyOfNet, DateOfNet FROM touched_nets)")
+        metadata = [f"SELECT m.* FROM {schema}.NET_METADATA m JOIN touched_nets t " +
+                    "ON m.FrequencyOfNet = t.FrequencyOfNet AND m.DateOfNet = t.DateOfNet" for source, schema in schemas]
+        if len(metadata) > 0:
+            # a station reporting through several sources for the same net counts once
+            cur.execute("INSERT INTO main.NET_METADATA SELECT TransmittingStation, FrequencyOfNet, DateOfNet, " +
+                        "MAX(Power), MAX(Height), AVG(Latitude), AVG(Longitude) " +
+                        "FROM (" + " UNION ALL ".join(metadata) + ") " +
+                        "GROUP BY TransmittingStation, FrequencyOfNet, DateOfNet")
+
+        cur.execute("DELETE FROM main.FEDERATED_NETS")
+        cur.executemany("INSERT INTO main.FEDERATED_NETS VALUES (?, ?, ?, ?, ?)", signatures)
+        self.con.commit()
+
+        # the rollups are recomputed from the merged reports, receivers and distances cannot be added up
+        self.update_net_statistics(nets)
+
+        return nets
+
+    def ingest(self, form_data_by_source, parallel=True, max_workers=None):
+        """ingest new reports for several sources, each into its own shard
+
+        :param dict form_data_by_source: source name -> all rows of that source's form, header first
+        :param bool parallel: True to ingest the shards in separate processes at the same time
+        :param int max_workers: number of worker processes, default one per CPU
+        :return: dict of source name -> set of (station, frequency, net date) touched
+        """
+        jobs = {source: (self.shards[source], self.report_database_filename, form_data)
+                for source, form_data in form_data_by_source.items()}
+
+        if parallel and len(jobs) > 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                futures = {source: executor.submit(ingest_source, *job) for source, job in jobs.items()}
+                affected = {source: future.result() for source, future in futures.items()}
+        else:
+            affected = {source: ingest_source(*job) for source, job in jobs.items()}
+
+        # new shard files get attached, existing ones are seen through the views already
+        self.attach_shards()
+
+        return affected
+
+    def populate_database_with_reports(self, form_data):
+        raise TypeError('a federated database is read only, ingest reports with ingest() into a source shard')
@@ -0,0 +1,225 @@
+"""form watcher module
+
+    Keep the report database and the web site current while a net is running.
+
+    A watcher polls a form source for a cheap revision marker (row count and
+    last timestamp, an HTTP ETag, or a file's size and modification time)
+    and only downloads the responses once the marker moves and has stopped
+    moving for a debounce period, so a burst of submissions during a net
+    triggers one update.  Only the new rows are ingested and only the
+    (station, frequency, date) outputs they touch are regenerated.
+
+    Sources:
+        SheetSource  the Google sheet behind the form
+        FileSource   a local CSV export of the sheet, for offline use and testing
+        HttpSource   any URL serving the Sheets API JSON, e.g. a local stand-in server
+
+"""
+import os
+import csv
+import json
+import time
+import urllib.request
+import urllib.error
+
+from sheet_fetcher import AsyncSheetFetcher, sheet_values_url
+
+
+class SheetSource:
+    """
+    The Google sheet behind the form, checked by reading only the timestamp column.
+    """
+
+    def __init__(self, spreadsheet_id, range_name, google_key, fetcher=None):
+        """
+        :param str spreadsheet_id: google spreadsheet id
+        :param str range_name: range of google sheet to load, e.g. 'Form Responses 1!A:AH'
+        :param str google_key: google api key for sheets access
+        :param fetcher: AsyncSheetFetcher to use, its connections are kept open between polls
+        """
+        sheet_name = range_name.split('!')[0]
+        self.fetcher = fetcher if fetcher is not None else AsyncSheetFetcher(max_concurrency=1)
+        self.url = sheet_values_url(spreadsheet_id, range_name, google_key)
+        self.timestamps_url = sheet_values_url(spreadsheet_id, f'{sheet_name}!A:A', google_key)
+
+    def _get(self, url):
+        values = self.fetcher.fetch_all({'sheet': url})['sheet']
+        if isinstance(values, Exception):
+            raise OSError(str(values))
+        return values
+
+    def revision(self):
+        """row count and last timestamp, from the timestamp column alone"""
+        timestamps = self._get(self.timestamps_url)
+        if len(timestamps) == 0:
+            return 0, None
+
+        return len(timestamps), timestamps[-1][0] if len(timestamps[-1]) > 0 else None
+
+    def fetch(self):
+        return self._get(self.url)
+
+
+class FileSource:
+    """
+    A CSV export of the form responses, header line first.
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def revision(self):
+        if not os.path.exists(self.file_name):
+            return None
+
+        stat = os.stat(self.file_name)
+        return stat.st_size, stat.st_mtime_ns
+
+    def fetch(self):
+        with open(self.file_name, 'r', newline='') as fp:
+            return [row for row in csv.reader(fp)]
+
+
+class HttpSource:
+    """
+    A URL serving {"values": [[...], ...]} as the Sheets API does, checked with HEAD and the ETag or Last-Modified.
+    """
+
+    def __init__(self, url, timeout=30):
+        self.url = url
+        self.timeout = timeout
+
+    def revision(self):
+        request = urllib.request.Request(self.url, method='HEAD')
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return (response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                    response.headers.get('Content-Length'))
+
+    def fetch(self):
+        with urllib.request.urlopen(self.url, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8')).get('values', [])
+
+
+class FormWatcher:
+    """
+    Poll a form source and feed new responses to a SimplexReportDatabase.
+    """
+
+    def __init__(self, db, source, on_change=None, poll_interval=60, debounce=120, max_wait=900):
+        """
+        :param db: SimplexReportDatabase to update
+        :param source: SheetSource, FileSource, HttpSource or anything with revision() and fetch()
+        :param on_change: called as on_change(affected) after new rows are ingested, affected being
+            the set of (station, frequency, net date) touched, default db.regenerate_outputs
+        :param float poll_interval: seconds between revision checks
+        :param float debounce: seconds the revision must stay the same before the responses are fetched
+        :param float max_wait: seconds after the first change at which an update happens regardless
+        """
+        self.db = db
+        self.source = source
+        self.on_change = on_change if on_change is not None else db.regenerate_outputs
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_wait = max_wait
+
+        self.ingested_revision = None
+        self.seen_revision = None
+        self.first_change_time = None
+        self.last_change_time = None
+        # ingested but not handed to on_change yet, because it failed
+        self.pending = set()
+        # polls in a row that failed, run() waits longer after each
+        self.failures = 0
+
+    def check_once(self, now=None):
+        """one polling step
+
+        Errors checking, fetching or ingesting the source, or from on_change, are printed rather than raised,
+        and the step is tried again at the next poll.
+        :param float now: current time, time.time() by default
+        :return: set of (station, frequency, net date) updated, empty if nothing was done
+        """
+        if now is None:
+            now = time.time()
+
+        try:
+            revision = self.source.revision()
+        except (OSError, urllib.error.URLError) as er:
+            print(f'could not check the form source: {er}')
+            self.failures += 1
+            return set()
+
+        if revision == self.ingested_revision:
+            self.first_change_time = None
+            self.regenerate()
+            return set()
+
+        if revision != self.seen_revision:
+            # still changing, wait until submissions settle
+            self.seen_revision = revision
+            self.last_change_time = now
+            if self.first_change_time is None:
+                self.first_change_time = now
+
+        settled = now - self.last_change_time >= self.debounce
+        overdue = now - self.first_change_time >= self.max_wait
+        if not (settled or overdue):
+            self.regenerate()
+            return set()
+
+        try:
+            form_data = self.source.fetch()
+        except (OSError, urllib.error.URLError, ValueError) as er:
+            # ingested_revision stays as it was, so the next poll tries again
+            print(f'could not fetch the form responses: {er}')
+            self.failures += 1
+            return set()
+
+        affected = set()
+        if form_data is not None and len(form_data) > 1:
+            try:
+                affected = self.db.append_new_reports(form_data)
+            except Exception as er:
+                # e.g. a locked database or a full disk, rows already written count as seen when the next poll
+                # ingests the responses again
+                print(f'could not ingest the form responses: {er}')
+                self.failures += 1
+                return set()
+
+        self.ingested_revision = revision
+        self.first_change_time = None
+
+        if len(affected) > 0:
+            print(f'{len(affected)} station reports updated')
+            self.pending.update(affected)
+        self.regenerate()
+
+        return affected
+
+    def regenerate(self):
+        """hand the pending outputs to on_change, they stay pending if it fails"""
+        if len(self.pending) > 0:
+            try:
+                self.on_change(set(self.pending))
+            except Exception as er:
+                print(f'could not regenerate the outputs: {er}')
+                self.failures += 1
+                return
+            self.pending = set()
+
+        self.failures = 0
+
+    def run(self, max_polls=None):
+        """poll until interrupted, or for max_polls checks
+
+        After failed polls the wait doubles, up to 16 poll intervals.
+        """
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                self.check_once()
+                polls += 1
+                if max_polls is None or polls < max_polls:
+                    time.sleep(self.poll_interval * 2 ** min(self.failures, 4))
+        except KeyboardInterrupt:
+            print('watcher stopped')
@@ -0,0 +1,175 @@
+"""net dates module
+
+    One spelling per net date, and queries over ranges of nets.
+
+    Hams type the date of the net into the form as 1/7/2021, 01/07/2021,
+    1/7/21 or 2021-01-07.  At ingest the date is normalized to the
+    unpadded m/d/yyyy the rest of the code and the web site use, and an
+    ISO yyyy-mm-dd copy is stored in the indexed NetDay column, which sorts
+    and compares like the dates themselves.  Every date filter goes through
+    date_condition, so a padded or unpadded date, a list of dates or a
+    NetWindow - a date range, a season or the last N nets - all become one
+    indexed condition on NetDay.
+
+"""
+import re
+import datetime
+from collections import namedtuple
+
+DATE_PATTERNS = [
+    # m/d/yyyy, m/d/yy, also with - or . between the parts
+    (re.compile(r'^(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})$'), ('month', 'day', 'year')),
+    # yyyy-mm-dd
+    (re.compile(r'^(\d{4})[/.-](\d{1,2})[/.-](\d{1,2})$'), ('year', 'month', 'day')),
+]
+
+SEASONS = {
+    # season: (first month, number of months), meteorological seasons
+    'spring': (3, 3),
+    'summer': (6, 3),
+    'fall': (9, 3),
+    'autumn': (9, 3),
+    'winter': (12, 3),
+}
+
+
+def parse_net_date(net_date):
+    """date of a net as typed into the form
+
+    :param net_date: text such as 1/7/2021, 01/07/2021, 1/7/21 or 2021-01-07, or a datetime.date
+    :return: datetime.date, None if it cannot be read as a date
+    """
+    if isinstance(net_date, datetime.datetime):
+        return net_date.date()
+    if isinstance(net_date, datetime.date):
+        return net_date
+    if not isinstance(net_date, str) or len(net_date.split()) == 0:
+        return None
+
+    # a time typed after the date is ignored
+    text = net_date.split()[0]
+    for pattern, fields in DATE_PATTERNS:
+        match = pattern.match(text)
+        if match is None:
+            continue
+        parts = dict(zip(fields, (int(group) for group in match.groups())))
+        if parts['year'] < 100:
+            parts['year'] += 2000
+        try:
+            return datetime.date(parts['year'], parts['month'], parts['day'])
+        except ValueError:
+            return None
+
+    return None
+
+
+def format_net_date(date):
+    """m/d/yyyy without zero padding, as DateOfNet is stored"""
+    return f'{date.month}/{date.day}/{date.year}'
+
+
+def normalize_net_date(net_date):
+    """the stored spelling of a net date, e.g. 01/07/2021 -> 1/7/2021
+
+    Text that is not a date is returned stripped but otherwise as it was.
+    """
+    date = parse_net_date(net_date)
+    if date is None:
+        return net_date.strip() if isinstance(net_date, str) else net_date
+
+    return format_net_date(date)
+
+
+def net_day(net_date):
+    """ISO yyyy-mm-dd of a net date for the NetDay column, None if it is not a date"""
+    date = parse_net_date(net_date)
+
+    return None if date is None else date.isoformat()
+
+
+class NetWindow(namedtuple('NetWindow', ['start', 'end', 'last'], defaults=(None, None, None))):
+    """
+    A range of nets: the nets from start to end, both included, the last N nets, or the last N within a range.
+    Dates may be given in any form parse_net_date reads, None leaves that side open.
+    """
+    __slots__ = ()
+
+    def __str__(self):
+        if self.start is not None and self.end is not None:
+            span = f'{normalize_net_date(self.start)} to {normalize_net_date(self.end)}'
+        elif self.start is not None:
+            span = f'since {normalize_net_date(self.start)}'
+        elif self.end is not None:
+            span = f'up to {normalize_net_date(self.end)}'
+        else:
+            span = None
+
+        if self.last is None:
+            return span or 'all nets'
+
+        return f'last {self.last} nets' + ('' if span is None else f', {span}')
+
+
+def season(name, year):
+    """the nets of one season, winter running from December of the year into the next
+
+    :param str name: spring, summer, fall (or autumn) or winter
+    :param int year:
+    :return: NetWindow
+    """
+    first_month, months = SEASONS[name.lower()]
+    start = datetime.date(year, first_month, 1)
+    end_month = first_month + months
+    end = datetime.date(year + (end_month - 1) // 12, (end_month - 1) % 12 + 1, 1) - datetime.timedelta(days=1)
+
+    return NetWindow(start, end)
+
+
+def date_condition(net_date, frequency=None, table='RESPONSES'):
+    """SQL condition on the indexed NetDay column selecting some nets
+
+    :param net_date: one date, a list of dates, a NetWindow, or None for all nets
+    :param float frequency: frequency the last N nets are counted on, None to count nets on any frequency
+    :param str table: table the last N nets are counted in
+    :return: (condition, parameters), condition None when every net is selected
+    """
+    if net_date is None:
+        return None, []
+
+    if isinstance(net_date, NetWindow):
+        conditions = []
+        parameters = []
+        if net_date.start is not None:
+            conditions.append("NetDay>=?")
+            parameters.append(net_day(net_date.start))
+        if net_date.end is not None:
+            conditions.append("NetDay<=?")
+            parameters.append(net_day(net_date.end))
+
+        if net_date.last is not None:
+            inner = ["NetDay IS NOT NULL"] + conditions
+            inner_parameters = list(parameters)
+            if frequency is not None:
+                inner.append("FrequencyOfNet=?")
+                inner_parameters.append(float(frequency))
+            conditions = [f"NetDay IN (SELECT DISTINCT NetDay FROM {table} WHERE {' AND '.join(inner)} " +
+                          "ORDER BY NetDay DESC LIMIT ?)"]
+            parameters = inner_parameters + [int(net_date.last)]
+
+        if len(conditions) == 0:
+            return None, []
+
+        return ' AND '.join(conditions), parameters
+
+    if isinstance(net_date, (str, datetime.date)):
+        net_date = [net_date]
+
+    days = [net_day(d) for d in net_date]
+    if None in days:
+        # something that is not a date can only match the text as it was stored
+        return "DateOfNet IN ({})".format(','.join('?' * len(days))), [normalize_net_date(d) for d in net_date]
+
+    if len(days) == 1:
+        return "NetDay=?", days
+
+    return "NetDay IN ({})".format(','.join('?' * len(days))), days
@@ -0,0 +1,155 @@
+"""net statistics module
+
+    Per net rollups of how well each transmitting station was heard.
+
+    The NET_STATISTICS table holds one row per (transmitting station,
+    frequency, net date) with the G/R, W/R and N/C counts, the number of
+    distinct receivers, the mean and max distance of the paths that were
+    heard and the transmit power used.  It is rebuilt only for the nets
+    touched by an ingest, so trend queries and summary pages read a few
+    small rows instead of re-aggregating RESPONSES.  Rows carry the NetDay
+    of net_dates and are indexed on it, so statistics over a window of nets
+    are read straight from the table.
+
+"""
+import pandas as pd
+import numpy as np
+
+from station_index import haversine_array
+from net_dates import net_day, date_condition
+
+NET_STATISTICS_COLUMNS = ['TransmittingStation', 'FrequencyOfNet', 'DateOfNet',
+                          'GoodCount', 'WeakCount', 'NoContactCount', 'Receivers',
+                          'MeanDistance', 'MaxDistance', 'TransmitPower', 'NetDay']
+
+
+def create_net_statistics_table(con):
+    """create the rollup table if this database does not have it yet
+
+    A table from before NetDay was added is dropped and created again, it only holds derived rows.
+    :return: True if the table was (re)created empty and has to be rebuilt
+    """
+    columns = [row[1] for row in con.execute("PRAGMA table_info(NET_STATISTICS)")]
+    if len(columns) > 0 and 'NetDay' in columns:
+        return False
+
+    con.execute("DROP TABLE IF EXISTS NET_STATISTICS")
+    con.execute("CREATE TABLE NET_STATISTICS (TransmittingStation TINYTEXT, FrequencyOfNet FLOAT, " +
+                "DateOfNet DATE, GoodCount INT, WeakCount INT, NoContactCount INT, Receivers INT, " +
+                "MeanDistance FLOAT, MaxDistance FLOAT, TransmitPower FLOAT, NetDay TEXT, " +
+                "PRIMARY KEY (TransmittingStation, FrequencyOfNet, DateOfNet))")
+    con.execute("CREATE INDEX IF NOT EXISTS NET_STATISTICS_NetDay ON NET_STATISTICS (FrequencyOfNet, NetDay)")
+    con.commit()
+
+    return True
+
+
+def summarize_responses(responses_df):
+    """aggregate RESPONSES rows into NET_STATISTICS rows
+
+    :param responses_df: RESPONSES rows for one or more nets
+    :return: DataFrame with NET_STATISTICS_COLUMNS
+    """
+    df = responses_df
+    keys = ['TransmittingStation', 'FrequencyOfNet', 'DateOfNet']
+
+    if len(df) == 0:
+        return pd.DataFrame(columns=NET_STATISTICS_COLUMNS)
+
+    # distances only count for the paths that were actually heard, values are stored as text
+    distance = haversine_array(pd.to_numeric(df['TransmittingStationLatitude'], errors='coerce'),
+                               pd.to_numeric(df['TransmittingStationLongitude'], errors='coerce'),
+                               pd.to_numeric(df['ReceivingStationLatitude'], errors='coerce'),
+                               pd.to_numeric(df['ReceivingStationLongitude'], errors='coerce'))
+    heard = df['QSOQuality'].isin(['G/R', 'W/R']).to_numpy()
+
+    work = pd.DataFrame({
+        'TransmittingStation': df['TransmittingStation'],
+        'FrequencyOfNet': df['FrequencyOfNet'].astype(float),
+        'DateOfNet': df['DateOfNet'],
+        'GoodCount': (df['QSOQuality'] == 'G/R').astype(int),
+        'WeakCount': (df['QSOQuality'] == 'W/R').astype(int),
+        'NoContactCount': (df['QSOQuality'] == 'N/C').astype(int),
+        # a receiver counts once it reported anything about the transmitting station
+        'Receiver': df['ReceivingStation'].where(df['QSOQuality'].isin(['G/R', 'W/R', 'N/C'])),
+        'Distance': np.where(heard, distance, np.nan),
+        'TransmitPower': pd.to_numeric(df['TransmittingStationPower'], errors='coerce'),
+    })
+
+    grouped = work.groupby(keys, sort=False)
+    rollup = grouped[['GoodCount', 'WeakCount', 'NoContactCount']].sum()
+    rollup['Receivers'] = grouped['Receiver'].nunique()
+    rollup['MeanDistance'] = grouped['Distance'].mean()
+    rollup['MaxDistance'] = grouped['Distance'].max()
+    rollup['TransmitPower'] = grouped['TransmitPower'].max()
+
+    rollup = rollup.reset_index()
+    rollup['NetDay'] = rollup['DateOfNet'].map(net_day)
+
+    return rollup[NET_STATISTICS_COLUMNS]
+
+
+def update_net_statistics(con, nets=None):
+    """recompute the rollups for some nets, or all of them
+
+    :param con: sqlite3 connection
+    :param nets: iterable of (frequency, net date) pairs touched by an ingest, None to rebuild everything
+    :return: number of rollup rows written
+    """
+    create_net_statistics_table(con)
+
+    if nets is None:
+        responses_df = pd.read_sql("SELECT * FROM RESPONSES", con)
+        con.execute("DELETE FROM NET_STATISTICS")
+    else:
+        nets = sorted(set((float(frequency), net_date) for frequency, net_date in nets))
+        if len(nets) == 0:
+            return 0
+
+        # one query for all the touched nets rather than one per net
+        con.execute("CREATE TEMP TABLE IF NOT EXISTS touched_nets (FrequencyOfNet FLOAT, DateOfNet DATE)")
+        con.execute("DELETE FROM touched_nets")
+        con.executemany("INSERT INTO touched_nets VALUES (?, ?)", nets)
+
+        responses_df = pd.read_sql("SELECT r.* FROM RESPONSES r JOIN touched_nets t " +
+                                   "ON r.FrequencyOfNet = t.FrequencyOfNet AND r.DateOfNet = t.DateOfNet", con)
+        con.execute("DELETE FROM NET_STATISTICS WHERE EXISTS (SELECT 1 FROM touched_nets t " +
+                    "WHERE NET_STATISTICS.FrequencyOfNet = t.FrequencyOfNet " +
+                    "AND NET_STATISTICS.DateOfNet = t.DateOfNet)")
+
+    rollup = summarize_responses(responses_df)
+    rollup = rollup.astype(object).where(rollup.notna(), None)
+    con.executemany(f"INSERT INTO NET_STATISTICS VALUES ({','.join('?' * len(NET_STATISTICS_COLUMNS))})",
+                    rollup.itertuples(index=False, name=None))
+    con.commit()
+
+    return len(rollup)
+
+
+def read_net_statistics(con, station=None, frequency=None, net_date=None):
+    """read rollup rows, any of the filters may be None
+
+    :param net_date: one date, a list of dates or a net_dates.NetWindow
+    :return: DataFrame ordered by net date, with a NetDate datetime column for plotting
+    """
+    conditions = []
+    parameters = []
+    if station is not None:
+        conditions.append("TransmittingStation=?")
+        parameters.append(station)
+    if frequency is not None:
+        conditions.append("FrequencyOfNet=?")
+        parameters.append(float(frequency))
+    condition, window_parameters = date_condition(net_date, frequency, table='NET_STATISTICS')
+    if condition is not None:
+        conditions.append(condition)
+        parameters.extend(window_parameters)
+
+    command = "SELECT * FROM NET_STATISTICS"
+    if len(conditions) > 0:
+        command = command + " WHERE " + " AND ".join(conditions)
+
+    df = pd.read_sql(command, con, params=parameters)
+    df['NetDate'] = pd.to_datetime(df['NetDay'], errors='coerce')
+
+    return df.sort_values(['NetDate', 'TransmittingStation']).reset_index(drop=True)
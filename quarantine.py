@@ -0,0 +1,140 @@
+"""quarantine module
+
+    Malformed form responses are set aside instead of stopping an ingest.
+
+    Every row of a batch is screened at once before any of it is cleaned
+    or written.  Rows that cannot be ingested - no call sign, a net date or
+    frequency that is not one, a reception quality the maps do not know,
+    a row the clean up chokes on, a station nobody can place on the map or
+    an insert SQLite refuses - go to the QUARANTINE table as they were
+    received, with a reason code and a short detail, and the rest of the
+    batch carries on.  One summary line per batch replaces the per row
+    output.  Once the cause is fixed, in the row, the station list or the
+    code, the rows are taken out of quarantine and ingested again.
+
+"""
+import json
+import datetime
+
+import pandas as pd
+
+from net_dates import net_day
+from reception_quality import QUALITIES
+
+REASONS = {
+    'missing_call': 'no call sign',
+    'bad_date': 'net date is not a date',
+    'bad_frequency': 'net frequency is not a number',
+    'bad_quality': 'unknown reception quality',
+    'clean_up_failed': 'the row could not be cleaned up',
+    'unknown_location': 'call sign not in the Hams table and no usable location reported',
+    'insert_failed': 'SQLite refused the row',
+}
+
+def create_quarantine_table(con):
+    """create the quarantine table if this database does not have it yet"""
+    con.execute("CREATE TABLE IF NOT EXISTS QUARANTINE (Id INTEGER PRIMARY KEY AUTOINCREMENT, " +
+                "QuarantinedAt DATETIME, Reason TEXT, Detail TEXT, " +
+                "ReportingTimestamp DATETIME, ReportingStation TINYTEXT, Header TEXT, Report TEXT)")
+    con.execute("CREATE INDEX IF NOT EXISTS QUARANTINE_Reason ON QUARANTINE (Reason)")
+    con.commit()
+
+
+def pad_reports(header, reports):
+    """copies of the rows padded to the header, the sheets API leaves out empty trailing cells"""
+    return [list(report) + [''] * (len(header) - len(report)) for report in reports]
+
+
+def screen_reports(header, reports, idx_first_call):
+    """check a batch of padded rows before clean up, all rows at once
+
+    :param list header: form header row
+    :param list reports: rows, see pad_reports
+    :param int idx_first_call: index of the first reception quality column
+    :return: list of (reason, detail) per row, None for rows that pass
+    """
+    if len(reports) == 0:
+        return []
+
+    df = pd.DataFrame([report[:idx_first_call] for report in reports], dtype=object)
+    call = df[1].astype(str).str.strip()
+    frequency = pd.to_numeric(df[3], errors='coerce')
+    day = df[2].map(net_day)
+
+    qualities = pd.DataFrame([report[idx_first_call:len(header)] for report in reports], dtype=object)
+    bad_quality = ~qualities.isin(QUALITIES)
+
+    problems = [None] * len(reports)
+    checks = [
+        ('bad_quality', bad_quality.any(axis=1).to_numpy(),
+         lambda i: ', '.join(sorted(set(str(q) for q in qualities.iloc[i][bad_quality.iloc[i]])))),
+        ('bad_frequency', frequency.isna().to_numpy(), lambda i: str(df.at[i, 3])),
+        ('bad_date', day.isna().to_numpy(), lambda i: str(df.at[i, 2])),
+        ('missing_call', (call == '').to_numpy(), lambda i: ''),
+    ]
+    # the last check that fails is the one reported, the most basic problem first
+    for reason, failed, detail in checks:
+        for i in failed.nonzero()[0]:
+            problems[i] = (reason, detail(i))
+
+    return problems
+
+
+def quarantine_reports(con, header, rejected):
+    """set rows aside
+
+    :param con: sqlite3 connection
+    :param list header: form header row
+    :param list rejected: (row as received, reason, detail)
+    """
+    if len(rejected) == 0:
+        return
+
+    create_quarantine_table(con)
+    now = datetime.datetime.now().isoformat(timespec='seconds')
+    header_text = json.dumps(header)
+    con.executemany("INSERT INTO QUARANTINE (QuarantinedAt, Reason, Detail, ReportingTimestamp, ReportingStation, " +
+                    "Header, Report) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(now, reason, detail,
+                      str(report[0]) if len(report) > 0 else '',
+                      str(report[1]).split()[0].upper() if len(report) > 1 and str(report[1]).split() else '',
+                      header_text, json.dumps(report))
+                     for report, reason, detail in rejected])
+    con.commit()
+
+
+def read_quarantine(con, reason=None):
+    """the quarantined rows, with Header and Report decoded to lists
+
+    :param str reason: only rows set aside for this reason, None for all
+    :return: DataFrame with the QUARANTINE columns
+    """
+    create_quarantine_table(con)
+    command = "SELECT * FROM QUARANTINE"
+    parameters = []
+    if reason is not None:
+        command = command + " WHERE Reason=?"
+        parameters.append(reason)
+
+    df = pd.read_sql(command + " ORDER BY Id", con, params=parameters)
+    df['Header'] = df['Header'].map(json.loads)
+    df['Report'] = df['Report'].map(json.loads)
+
+    return df
+
+
+def release_reports(con, ids):
+    """take rows out of quarantine, without committing
+
+    The caller commits once the rows are ingested again, or rolls back to keep them in quarantine.
+    :param ids: quarantine ids
+    """
+    con.executemany("DELETE FROM QUARANTINE WHERE Id=?", [(int(i),) for i in ids])
+
+
+def summary_line(total, rejected):
+    """one line counting the rows of a batch set aside by reason"""
+    counts = pd.Series([reason for report, reason, detail in rejected], dtype=object).value_counts()
+
+    return f'quarantined {len(rejected)} of {total} rows: ' + \
+        ', '.join(f'{n} {reason}' for reason, n in counts.items())
@@ -0,0 +1,12 @@
+"""reception quality module
+
+    The reception qualities of the report form and the numbers the maps,
+    statistics and analyses use for them.
+
+"""
+
+# a station heard with a good or weak signal, or not at all
+QUALITY_CODES = {'G/R': 4, 'W/R': 2, 'N/C': 0}
+
+# everything a reception column of the form may hold, N/A or blank where no report was made
+QUALITIES = list(QUALITY_CODES) + ['N/A', '']
@@ -0,0 +1,101 @@
+"""reciprocity module
+
+    Compare "A heard B" with "B heard A".
+
+    The reports of a net are laid out as a transmitter x receiver matrix of
+    coded quality (G/R 4, W/R 2, N/C 0, nan when there is no report), and
+    every comparison is done on the whole matrix at once: reciprocal pair
+    agreement, the asymmetric links and, per station, how well it hears
+    compared to how well it is heard.
+
+"""
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from reception_quality import QUALITY_CODES
+
+
+def quality_matrix(responses_df, stations):
+    """transmitter x receiver matrix of coded reception quality
+
+    :param responses_df: RESPONSES rows with TransmittingStation, ReceivingStation and QSOQuality
+    :param list stations: call signs, the order of the matrix rows and columns
+    :return: array shaped (n, n), element [t, r] is how well r heard t, averaged over the nets
+        in responses_df, nan where r did not report on t
+    """
+    station_number = {call: i for i, call in enumerate(stations)}
+    n = len(stations)
+
+    codes = responses_df['QSOQuality'].map(QUALITY_CODES)
+    t = responses_df['TransmittingStation'].map(station_number)
+    r = responses_df['ReceivingStation'].map(station_number)
+    good = (codes.notna() & t.notna() & r.notna()).to_numpy()
+
+    t = t[good].to_numpy(dtype=int)
+    r = r[good].to_numpy(dtype=int)
+    codes = codes[good].to_numpy(dtype=float)
+
+    total = np.zeros((n, n))
+    count = np.zeros((n, n))
+    np.add.at(total, (t, r), codes)
+    np.add.at(count, (t, r), 1)
+
+    with np.errstate(invalid='ignore'):
+        return total / count
+
+
+def reciprocal_pairs(matrix, stations):
+    """every pair of stations with reports in both directions
+
+    :param matrix: from quality_matrix
+    :param list stations: call signs in matrix order
+    :return: DataFrame of StationA, StationB, BHeardA, AHeardB, Difference (BHeardA - AHeardB), Agree
+    """
+    i, j = np.triu_indices(len(stations), k=1)
+    a_to_b = matrix[i, j]
+    b_to_a = matrix[j, i]
+    both = ~np.isnan(a_to_b) & ~np.isnan(b_to_a)
+
+    i, j, a_to_b, b_to_a = i[both], j[both], a_to_b[both], b_to_a[both]
+    stations = np.asarray(stations, dtype=object)
+
+    return pd.DataFrame({'StationA': stations[i],
+                         'StationB': stations[j],
+                         'BHeardA': a_to_b,
+                         'AHeardB': b_to_a,
+                         'Difference': a_to_b - b_to_a,
+                         'Agree': a_to_b == b_to_a})
+
+
+def station_balance(matrix, stations):
+    """how well each station hears against how well it is heard
+
+    :return: DataFrame of Call, Heard (mean quality others heard it with), Hears (mean quality it heard
+        others with), Balance (Hears - Heard, > 0 hears better than it is heard), and the report counts
+    """
+    # stations without any reports give all-nan slices
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        heard = np.nanmean(matrix, axis=1)
+        hears = np.nanmean(matrix, axis=0)
+
+    return pd.DataFrame({'Call': stations,
+                         'Heard': heard,
+                         'Hears': hears,
+                         'Balance': hears - heard,
+                         'HeardReports': (~np.isnan(matrix)).sum(axis=1),
+                         'HearsReports': (~np.isnan(matrix)).sum(axis=0)})
+
+
+def summarize_reciprocity(pairs_df):
+    """agreement over all reciprocal pairs, as a dict"""
+    n = len(pairs_df)
+    if n == 0:
+        return {'pairs': 0, 'agreement': np.nan, 'asymmetric': 0, 'mean_abs_difference': np.nan}
+
+    return {'pairs': n,
+            'agreement': float(pairs_df['Agree'].mean()),
+            'asymmetric': int((pairs_df['Difference'].abs() >= 2).sum()),
+            'mean_abs_difference': float(pairs_df['Difference'].abs().mean())}
@@ -0,0 +1,130 @@
+"""relay module
+
+    Plan how traffic gets from one station to another on simplex.
+
+    The reception reports form a directed graph: an edge runs from A to B
+    when B heard A.  Edges cost 4 / quality, so a G/R hop costs 1 and a W/R
+    hop 2, with the quality averaged over the nets used to build the graph.
+    Best relay routes between all pairs of stations come from one
+    Floyd-Warshall pass over NumPy arrays, and from the same reachability
+    the groups of stations that can reach each other and the stations whose
+    loss would cut others off.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def transitive_closure(adjacency):
+    """reachability matrix of a boolean adjacency matrix, by repeated squaring"""
+    reach = adjacency | np.eye(len(adjacency), dtype=bool)
+    while True:
+        step = (reach.astype(np.float32) @ reach.astype(np.float32)) > 0
+        if np.array_equal(step, reach):
+            return reach
+        reach = step
+
+
+class RelayGraph:
+    """
+    All-pairs best relay routes over the reception graph of one frequency and set of nets.
+    """
+
+    def __init__(self, matrix, stations, min_quality=1.0):
+        """
+        :param matrix: transmitter x receiver quality, see reciprocity.quality_matrix
+        :param list stations: call signs in matrix order
+        :param float min_quality: mean quality below which a link is not usable, 1.0 drops links
+            that were N/C more often than W/R
+        """
+        self.stations = list(stations)
+        self.station_number = {call: i for i, call in enumerate(self.stations)}
+        n = len(self.stations)
+
+        quality = np.where(np.isnan(matrix), 0.0, matrix)
+        self.adjacency = quality >= min_quality
+        np.fill_diagonal(self.adjacency, False)
+
+        with np.errstate(divide='ignore'):
+            cost = np.where(self.adjacency, 4.0 / quality, np.inf)
+        np.fill_diagonal(cost, 0.0)
+
+        # Floyd-Warshall, one vectorized relaxation per intermediate station
+        self.cost = cost
+        self.next_hop = np.where(self.adjacency, np.arange(n)[None, :], -1)
+        np.fill_diagonal(self.next_hop, np.arange(n))
+        for k in range(n):
+            through_k = self.cost[:, k, None] + self.cost[None, k, :]
+            better = through_k < self.cost
+            self.cost = np.where(better, through_k, self.cost)
+            self.next_hop = np.where(better, self.next_hop[:, k, None], self.next_hop)
+
+        self.reachable = np.isfinite(self.cost)
+
+    def route(self, origin, destination):
+        """best relay route between two stations
+
+        :return: list of call signs from origin to destination, empty if there is no route
+        """
+        i = self.station_number[origin]
+        j = self.station_number[destination]
+        if not self.reachable[i, j]:
+            return []
+
+        path = [i]
+        while path[-1] != j:
+            path.append(int(self.next_hop[path[-1], j]))
+
+        return [self.stations[k] for k in path]
+
+    def routes(self):
+        """best route between every ordered pair of different stations
+
+        :return: DataFrame of Origin, Destination, Cost, Hops, Relays (call signs in between)
+        """
+        i, j = np.nonzero(~np.eye(len(self.stations), dtype=bool))
+        rows = []
+        for a, b in zip(i, j):
+            path = self.route(self.stations[a], self.stations[b])
+            rows.append((self.stations[a], self.stations[b], self.cost[a, b],
+                         len(path) - 1 if len(path) > 0 else None, ' '.join(path[1:-1])))
+
+        return pd.DataFrame(rows, columns=['Origin', 'Destination', 'Cost', 'Hops', 'Relays'])
+
+    def components(self):
+        """groups of stations that can all reach each other, possibly through relays
+
+        :return: list of lists of call signs, largest group first
+        """
+        mutual = self.reachable & self.reachable.T
+        labels = {}
+        for i in range(len(self.stations)):
+            key = mutual[i].tobytes()
+            labels.setdefault(key, []).append(self.stations[i])
+
+        return sorted(labels.values(), key=len, reverse=True)
+
+    def single_points_of_failure(self):
+        """stations whose loss leaves other pairs of stations without any route
+
+        :return: DataFrame of Call and PairsCutOff, only stations that cut at least one pair, worst first
+        """
+        n = len(self.stations)
+        before = self.reachable.copy()
+
+        rows = []
+        for v in range(n):
+            keep = np.ones(n, dtype=bool)
+            keep[v] = False
+            # a station that relays nothing cannot cut anyone off
+            if not (self.adjacency[:, v].any() and self.adjacency[v, :].any()):
+                continue
+
+            after = transitive_closure(self.adjacency[np.ix_(keep, keep)])
+            cut = int((before[np.ix_(keep, keep)] & ~after).sum())
+            if cut > 0:
+                rows.append((self.stations[v], cut))
+
+        df = pd.DataFrame(rows, columns=['Call', 'PairsCutOff'])
+
+        return df.sort_values('PairsCutOff', ascending=False, kind='stable').reset_index(drop=True)
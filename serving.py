@@ -0,0 +1,123 @@
+"""serving module
+
+    Read only access to the report database for rendering workers and servers.
+
+    connect_read_only opens the database through a read only URI, with
+    immutable=1 for a published copy nobody writes to any more: SQLite then
+    takes no locks and never checks for changes, so any number of readers
+    run side by side.  Pages are memory mapped, so every process reading
+    the file shares the operating system's page cache instead of copying
+    pages into its own, and the per connection page cache is made larger.
+
+    ReceptionQueries keeps the reception queries of the maps as fixed SQL
+    texts with parameters, so each is prepared once per connection and then
+    found in the connection's statement cache, and hands back NumPy arrays
+    ready for a ColumnDataSource rather than building a DataFrame per call.
+
+"""
+import sqlite3
+import pathlib
+import urllib.parse
+
+import numpy as np
+
+from net_dates import date_condition
+from reception_quality import QUALITY_CODES
+
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE = 64 * 1024 * 1024
+
+
+def read_only_uri(report_database_filename, immutable=False):
+    """SQLite URI opening a database file read only"""
+    path = urllib.parse.quote(pathlib.Path(report_database_filename).resolve().as_posix())
+    uri = f'file:{path}?mode=ro'
+    if immutable:
+        uri = uri + '&immutable=1'
+
+    return uri
+
+
+def connect_read_only(report_database_filename, immutable=False, mmap_size=MMAP_SIZE, cache_size=CACHE_SIZE,
+                      cached_statements=256):
+    """open a report database for reading only
+
+    :param str report_database_filename: SQL file created by SimplexReportDatabase
+    :param bool immutable: True for a file that does not change while it is open, e.g. a published snapshot,
+        so no locks are taken. A file that is still written to must be opened with False.
+    :param int mmap_size: bytes of the file to memory map
+    :param int cache_size: bytes of page cache for this connection
+    :param int cached_statements: prepared statements kept per connection
+    :return: sqlite3 connection
+    """
+    if not pathlib.Path(report_database_filename).exists():
+        # a read only open would otherwise fail with a less helpful message
+        raise FileNotFoundError(f'report database {report_database_filename} not found')
+
+    con = sqlite3.connect(read_only_uri(report_database_filename, immutable), uri=True,
+                          check_same_thread=False, cached_statements=cached_statements)
+    con.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+    # a negative cache size is in KiB rather than pages
+    con.execute(f"PRAGMA cache_size={-int(cache_size // 1024)}")
+    con.execute("PRAGMA temp_store=MEMORY")
+    con.execute("PRAGMA query_only=1")
+
+    return con
+
+
+class ReceptionQueries:
+    """
+    Prepared reception queries of one connection, results as NumPy arrays.
+    """
+    RECEPTION = "SELECT ReportingStation, QSOQuality, TransmittingStationPower FROM RESPONSES " +\
+                "WHERE TransmittingStation=? AND FrequencyOfNet=?"
+
+    def __init__(self, con, stations_df):
+        """
+        :param con: sqlite3 connection
+        :param stations_df: Call, x and y of every station, see SimplexReportDatabase.wgs84_to_web_mercator
+        """
+        self.con = con
+        self.station_number = {call: i for i, call in enumerate(stations_df['Call'])}
+        # one extra entry at the end for calls that are not in the Hams table
+        self.x = np.append(stations_df['x'].to_numpy(dtype=float), np.nan)
+        self.y = np.append(stations_df['y'].to_numpy(dtype=float), np.nan)
+
+    def reception(self, transmitting_station, frequency, net_date=None):
+        """who heard a station, how well and where
+
+        :param str transmitting_station: station call sign
+        :param float frequency:
+        :param net_date: date of simplex net, a list of dates, a NetWindow, or None for all nets
+        :return: dict of arrays ReportingStation, QSOQuality, ReceivedQualityValue (G/R 4, W/R 2, N/C 0,
+            nan otherwise), ReceivedX, ReceivedY and TransmittingStationPower (nan where unknown)
+        """
+        command = self.RECEPTION
+        parameters = [transmitting_station, float(frequency)]
+        condition, window_parameters = date_condition(net_date, frequency)
+        if condition is not None:
+            command = command + " AND " + condition
+            parameters.extend(window_parameters)
+
+        rows = self.con.execute(command, parameters).fetchall()
+        calls = np.array([row[0] for row in rows], dtype=object)
+        qualities = np.array([row[1] for row in rows], dtype=object)
+        station_numbers = np.array([self.station_number.get(call, -1) for call in calls], dtype=int)
+
+        return {
+            'ReportingStation': calls,
+            'QSOQuality': qualities,
+            'ReceivedQualityValue': np.array([QUALITY_CODES.get(quality, np.nan) for quality in qualities],
+                                             dtype=float),
+            'ReceivedX': self.x[station_numbers],
+            'ReceivedY': self.y[station_numbers],
+            # power is stored as text and 'None' where no report of the transmitting station filled it in
+            'TransmittingStationPower': np.array([to_float(row[2]) for row in rows], dtype=float),
+        }
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
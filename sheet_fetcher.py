@@ -0,0 +1,217 @@
+"""sheet fetcher module
+
+    Fetch several sheet ranges, sheets or forms at the same time.
+
+    Requests go straight to the Sheets REST endpoint (or any URL answering
+    with the same {"values": [...]} JSON, e.g. a local stand-in server).
+    An asyncio front end runs them with bounded concurrency over a pool of
+    keep-alive HTTP connections, retries throttling and server errors with
+    exponential backoff, sends If-None-Match/If-Modified-Since when a URL
+    was fetched before, and hands each result back as soon as it arrives.
+
+    The requests themselves are blocking http.client calls, each run on a
+    thread of the fetcher's own pool, so they wait side by side without
+    holding up the event loop.  Code already inside an event loop awaits
+    fetch_all_async; fetch_all is the synchronous way in and also works
+    from inside a running loop, e.g. a notebook, by running the fetch on a
+    loop of its own in another thread.
+
+"""
+import json
+import time
+import queue
+import random
+import asyncio
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+SHEETS_URL = 'https://sheets.googleapis.com/v4/spreadsheets'
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def sheet_values_url(spreadsheet_id, range_name, key, base_url=SHEETS_URL):
+    """REST URL of one range of a google sheet"""
+    return '{}/{}/values/{}?{}'.format(base_url, spreadsheet_id, urllib.parse.quote(range_name, safe=''),
+                                       urllib.parse.urlencode({'key': key}))
+
+
+class FetchError(Exception):
+    """a source could not be fetched, after retries"""
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections per host, shared by the worker threads.
+    """
+
+    def __init__(self, size=4, timeout=30):
+        self.size = size
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def _queue(self, key):
+        with self.lock:
+            return self.idle.setdefault(key, queue.LifoQueue(maxsize=self.size))
+
+    def request(self, url, headers=None):
+        """one GET on a pooled connection
+
+        :return: (status, response headers, body bytes)
+        """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+
+        idle = self._queue(key)
+        try:
+            con = idle.get_nowait()
+        except queue.Empty:
+            connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+            con = connection_class(parts.netloc, timeout=self.timeout)
+
+        try:
+            con.request('GET', path, headers=headers or {})
+            response = con.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            con.close()
+            raise
+
+        if response.will_close:
+            con.close()
+        else:
+            try:
+                idle.put_nowait(con)
+            except queue.Full:
+                con.close()
+
+        return response.status, response.headers, body
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                while not idle.empty():
+                    idle.get_nowait().close()
+            self.idle = {}
+
+
+class AsyncSheetFetcher:
+    """
+    Concurrent, retrying, conditional fetching of sheet values.
+    """
+
+    def __init__(self, max_concurrency=4, retries=4, backoff=0.5, timeout=30):
+        """
+        :param int max_concurrency: requests in flight at once, also the number of pooled connections per host
+        :param int retries: retries after the first attempt for throttling, server and connection errors
+        :param float backoff: seconds before the first retry, doubled for each further one
+        :param float timeout: seconds per request
+        """
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(size=max_concurrency, timeout=timeout)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='sheet_fetcher')
+        # url -> (etag, last modified, values) for conditional requests
+        self.validators = {}
+
+    def _get(self, url):
+        """blocking fetch with retries, run in a worker thread"""
+        headers = {'Accept': 'application/json', 'Accept-Encoding': 'identity'}
+        cached = self.validators.get(url)
+        if cached is not None:
+            if cached[0] is not None:
+                headers['If-None-Match'] = cached[0]
+            if cached[1] is not None:
+                headers['If-Modified-Since'] = cached[1]
+
+        for attempt in range(self.retries + 1):
+            try:
+                status, response_headers, body = self.pool.request(url, headers)
+            except (OSError, http.client.HTTPException) as er:
+                status, problem = None, er
+            else:
+                if status == 304 and cached is not None:
+                    return cached[2]
+                if status == 200:
+                    # a 200 with an HTML error page or other non-JSON body is a failure, not data
+                    try:
+                        values = json.loads(body.decode('utf-8')).get('values', [])
+                    except (ValueError, AttributeError) as er:
+                        raise FetchError(f'could not read {url.split("?")[0]}: {er}') from er
+                    self.validators[url] = (response_headers.get('ETag'), response_headers.get('Last-Modified'),
+                                            values)
+                    return values
+                problem = f'HTTP {status}'
+                if status not in RETRY_STATUS:
+                    break
+
+            if attempt < self.retries:
+                # exponential backoff with jitter so parallel retries spread out
+                time.sleep(self.backoff * 2 ** attempt * (0.5 + random.random()))
+
+        raise FetchError(f'could not fetch {url.split("?")[0]}: {problem}')
+
+    async def fetch_one(self, name, url, semaphore):
+        async with semaphore:
+            values = await asyncio.get_running_loop().run_in_executor(self.executor, self._get, url)
+        return name, values
+
+    async def iter_fetch(self, urls):
+        """fetch several sources concurrently, yielding each as it arrives
+
+        :param dict urls: source name -> URL
+        :return: async iterator of (name, values or the exception that stopped the fetch)
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        tasks = [asyncio.ensure_future(self.fetch_one(name, url, semaphore)) for name, url in urls.items()]
+        names = {task: name for task, name in zip(tasks, urls)}
+
+        pending = set(tasks)
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    yield names[task], task.exception()
+                else:
+                    yield task.result()
+
+    async def fetch_all_async(self, urls, on_result=None):
+        """fetch several sources concurrently, from inside an event loop
+
+        :param dict urls: source name -> URL
+        :param on_result: called as on_result(name, values) for each source as soon as it arrives
+        :return: dict of name -> values, the exception for the sources that failed
+        """
+        results = {}
+        async for name, values in self.iter_fetch(urls):
+            results[name] = values
+            if on_result is not None and not isinstance(values, Exception):
+                on_result(name, values)
+
+        return results
+
+    def fetch_all(self, urls, on_result=None):
+        """fetch several sources concurrently from synchronous code
+
+        Called while an event loop is running in this thread, the fetch runs on its own loop in
+        another thread, and on_result is called from that thread.
+        :param dict urls: source name -> URL
+        :param on_result: called as on_result(name, values) for each source as soon as it arrives
+        :return: dict of name -> values, the exception for the sources that failed
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.fetch_all_async(urls, on_result))
+
+        # asyncio.run refuses to start a loop inside a running one
+        with ThreadPoolExecutor(max_workers=1) as runner:
+            return runner.submit(asyncio.run, self.fetch_all_async(urls, on_result)).result()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.pool.close()
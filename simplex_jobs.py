@@ -0,0 +1,445 @@
+"""simplex jobs - one command line entry point for the report database and web site
+
+    python simplex_jobs.py [-c simplex.ini] sync     fetch the forms and add new reports, then rollup and render
+    python simplex_jobs.py [-c simplex.ini] rebuild  recreate the database from the forms, then rollup and render
+    python simplex_jobs.py [-c simplex.ini] render   rollup and render whatever is out of date
+    python simplex_jobs.py [-c simplex.ini] serve    serve the site directory over http
+    python simplex_jobs.py [-c simplex.ini] bench    time the main queries and renderers
+
+    Settings come from an ini file, see simplex.ini.example, in place of the
+    paths, sheet id, range and key that used to be copied into every driver script.
+
+    The steps form a small dependency graph, sync -> rollup -> render.  Each
+    step records a fingerprint of its inputs (file sizes and modification
+    times, falling back to content hashes when those change, and the
+    settings it uses) in a state file next to the database, and is skipped
+    when nothing it depends on changed.  Within a step only the nets whose
+    reports changed are redone: the state file also keeps a row count per
+    net, so the rollup recomputes those nets alone and render redraws their
+    pages, the all-nets pages of their frequencies and the index.  New
+    render settings, a new station list or a missing record of the nets
+    render everything again.
+
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import tempfile
+import configparser
+import http.server
+import functools
+
+from simplex_net import SimplexReportDatabase as srd
+from sheet_fetcher import sheet_values_url
+from net_dates import normalize_net_date
+from coverage_grid import CoverageCache
+
+STEPS = {
+    # step: steps it depends on
+    'sync': [],
+    'rebuild': [],
+    'rollup': [],
+    'render': ['rollup'],
+}
+# steps that bring others up to date as they go, ingest updates the rollup of the nets it touches
+KEEPS_CURRENT = {
+    'sync': ['rollup'],
+    'rebuild': ['rollup'],
+}
+
+
+def load_config(config_filename):
+    config = configparser.ConfigParser()
+    if not config.read(config_filename):
+        raise FileNotFoundError(f'configuration file {config_filename} not found')
+
+    return config
+
+
+def config_list(config, section, option, convert=str):
+    """comma separated list setting, empty for a missing or blank setting"""
+    text = config.get(section, option, fallback='')
+    return [convert(item.strip()) for item in text.split(',') if item.strip() != '']
+
+
+def sources(config):
+    """form sources from the [source ...] sections, name -> (spreadsheet id, range, key)"""
+    found = {}
+    for section in config.sections():
+        if section == 'source' or section.startswith('source '):
+            name = section[len('source'):].strip() or 'form'
+            found[name] = (config.get(section, 'spreadsheet_id'),
+                           config.get(section, 'range', fallback='Form Responses 1!A:AH'),
+                           config.get(section, 'google_key'))
+
+    return found
+
+
+def net_signatures(db):
+    """what the reports of each net and the station list look like now, cheap to compare
+
+    :return: dict with Hams, a hash of the station list, and nets, "frequency date" -> [rows, last rowid]
+    """
+    hams = hashlib.sha1(repr(db.con.execute("SELECT Call, Latitude, Longitude FROM Hams ORDER BY Id")
+                             .fetchall()).encode('utf-8')).hexdigest()
+    nets = {f'{frequency!r} {net_date}': [count, last] for frequency, net_date, count, last in
+            db.con.execute("SELECT FrequencyOfNet, DateOfNet, COUNT(*), MAX(rowid) FROM RESPONSES " +
+                           "GROUP BY FrequencyOfNet, DateOfNet")}
+
+    return {'Hams': hams, 'nets': nets}
+
+
+def file_fingerprint(file_name, previous=None):
+    """(size, mtime, sha1) of a file, the hash reused from previous when size and mtime did not change"""
+    if file_name is None or not os.path.exists(file_name):
+        return None
+
+    stat = os.stat(file_name)
+    if previous is not None and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+        return previous
+
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as fp:
+        for block in iter(functools.partial(fp.read, 1024 * 1024), b''):
+            h.update(block)
+
+    return [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+
+
+class JobRunner:
+    """
+    Runs the sync, rollup and render steps, skipping those whose inputs did not change.
+    """
+
+    def __init__(self, config, force=False):
+        """
+        :param config: ConfigParser with the settings
+        :param bool force: True to run every step regardless of the recorded state
+        """
+        self.config = config
+        self.force = force
+
+        self.database_filename = config.get('database', 'filename', fallback='2mreports.db')
+        self.station_locations_filename = config.get('database', 'station_locations', fallback=None)
+        self.state_filename = self.database_filename + '.jobs.json'
+
+        self.state = {}
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, 'r') as fp:
+                self.state = json.load(fp)
+
+        self.db = None
+
+    def save_state(self):
+        with open(self.state_filename, 'w') as fp:
+            json.dump(self.state, fp, indent=1)
+
+    def open_database(self, recreate=False):
+        if self.db is not None and not recreate:
+            return self.db
+
+        kwargs = {'coverage_cache_dir': self.config.get('render', 'coverage_cache_dir', fallback=None) or None,
+                  'snapshot_dir': self.config.get('database', 'snapshot_dir', fallback=None) or None,
+                  'compress_snapshots': self.config.getboolean('database', 'compress_snapshots', fallback=False)}
+
+        if recreate:
+            found = sources(self.config)
+            if len(found) == 0:
+                raise ValueError('rebuild needs a [source] section in the configuration')
+            name, (spreadsheet_id, range_name, google_key) = sorted(found.items())[0]
+            self.db = srd(self.database_filename,
+                          station_locations_filename=self.station_locations_filename,
+                          spreadsheet_id=spreadsheet_id,
+                          range_name=range_name,
+                          google_key=google_key,
+                          recreate_database=True,
+                          **kwargs)
+            # any further sources are added on top of the first
+            others = {other: sheet_values_url(*source) for other, source in found.items() if other != name}
+            if len(others) > 0:
+                self.db.sync_sources(others)
+        else:
+            self.db = srd(self.database_filename, **kwargs)
+
+        return self.db
+
+    def fingerprint(self, step):
+        """what a step's output depends on"""
+        previous = self.state.get(step, {}).get('inputs', {})
+        inputs = {'database': file_fingerprint(self.database_filename, previous.get('database')),
+                  'stations': file_fingerprint(self.station_locations_filename, previous.get('stations'))}
+
+        if step == 'render':
+            inputs['settings'] = dict(self.config['render']) if self.config.has_section('render') else {}
+
+        return inputs
+
+    def up_to_date(self, step):
+        if self.force or step not in self.state:
+            return False
+
+        if step == 'render':
+            site_dir = self.config.get('render', 'site_dir', fallback='site')
+            if not os.path.isdir(site_dir):
+                return False
+
+        return self.state[step]['inputs'] == self.fingerprint(step)
+
+    def run(self, target):
+        """run a step after the steps it depends on, each only if out of date"""
+        for dependency in STEPS[target]:
+            self.run(dependency)
+
+        if target not in ('sync', 'rebuild') and self.up_to_date(target):
+            print(f'{target}: up to date')
+            return
+
+        start = time.time()
+        getattr(self, 'step_' + target)()
+
+        # recorded after the step, so its own writes do not make it look out of date next time
+        for step in [target] + KEEPS_CURRENT.get(target, []):
+            self.state[step] = {'inputs': self.fingerprint(step), 'finished': time.time()}
+        self.save_state()
+        print(f'{target}: done in {time.time() - start:.1f} s')
+
+    def changed_nets(self, db):
+        """nets whose reports changed since this was last asked, and record how they look now
+
+        :return: set of (frequency, net date), None if every net has to be redone
+        """
+        signatures = net_signatures(db)
+        previous = self.state.get('net_signatures')
+        self.state['net_signatures'] = signatures
+        if previous is None or previous['Hams'] != signatures['Hams']:
+            return None
+
+        changed = set()
+        for key in set(previous['nets']) | set(signatures['nets']):
+            if previous['nets'].get(key) != signatures['nets'].get(key):
+                frequency, net_date = key.split(' ', 1)
+                changed.add((float(frequency), net_date))
+
+        return changed
+
+    def mark_for_render(self, nets):
+        """add nets to those render has to redraw, None for all of them"""
+        pending = self.state.get('pending', [])
+        if nets is None or pending is None:
+            self.state['pending'] = None
+        else:
+            self.state['pending'] = sorted(set(tuple(net) for net in pending) | set(nets))
+
+    def roll_up(self, db, rolled_up=()):
+        """bring the statistics of the changed nets up to date and queue their pages
+
+        :param set rolled_up: (frequency, net date) already brought up to date, e.g. by an ingest
+        :return: number of rollup rows written
+        """
+        changed = self.changed_nets(db)
+        if changed is None:
+            rows = db.update_net_statistics()
+        else:
+            rows = db.update_net_statistics(changed - set(rolled_up))
+        self.mark_for_render(changed)
+
+        return rows
+
+    def step_sync(self):
+        urls = {name: sheet_values_url(*source) for name, source in sources(self.config).items()}
+        db = self.open_database()
+        affected = db.sync_sources(urls)
+        print(f'sync: {len(affected)} station reports touched')
+        # the ingest refreshed the rollup of the nets it touched
+        self.roll_up(db, rolled_up=set((frequency, net_date) for station, frequency, net_date in affected))
+
+    def step_rebuild(self):
+        db = self.open_database(recreate=True)
+        self.changed_nets(db)
+        self.mark_for_render(None)
+
+    def step_rollup(self):
+        rows = self.roll_up(self.open_database())
+        print(f'rollup: {rows} rows')
+
+    def nets_to_render(self):
+        """(frequency, net date) whose pages have to be redrawn, net date None for the all-nets pages,
+        None to redraw everything"""
+        previous = self.state.get('render', {}).get('inputs')
+        current = self.fingerprint('render')
+        site_dir = self.config.get('render', 'site_dir', fallback='site')
+        pending = self.state.get('pending', [])
+        if (self.force or previous is None or pending is None or not os.path.isdir(site_dir) or
+                previous['settings'] != current['settings'] or previous['stations'] != current['stations']):
+            return None
+
+        nets = set((float(frequency), net_date) for frequency, net_date in pending)
+        # the all-nets pages of a frequency change with any of its nets
+        nets.update((frequency, None) for frequency, net_date in list(nets))
+
+        return nets
+
+    def step_render(self):
+        db = self.open_database()
+        frequencies = config_list(self.config, 'render', 'frequencies', float)
+        dates = config_list(self.config, 'render', 'dates') or None
+        site_dir = self.config.get('render', 'site_dir', fallback='site')
+        only = self.nets_to_render()
+
+        changed = db.export_site_bundles(frequencies, dates=dates, out_dir=site_dir, only=only)
+        print(f'render: {len(changed)} site files changed')
+
+        if self.config.getboolean('render', 'thumbnails', fallback=False):
+            for frequency in frequencies:
+                for net_date in [None] + [normalize_net_date(d) for d in dates or []]:
+                    if only is None or (float(frequency), net_date) in only:
+                        db.export_station_thumbnails(frequency, net_date,
+                                                     out_dir=os.path.join(site_dir, 'thumbnails'))
+
+        if self.config.getboolean('render', 'bokeh_pages', fallback=False):
+            self.write_bokeh_pages(db, frequencies, dates or [], site_dir, only=only)
+
+        self.state['pending'] = []
+
+    @staticmethod
+    def write_bokeh_pages(db, frequencies, dates, site_dir, only=None):
+        """the Bokeh pages and index of the original web site
+
+        :param set only: (frequency, net date) pages to redraw, net date None for the all-nets page of a frequency,
+            None to redraw them all. The index is always written.
+        """
+        plot_file_list1 = [(f, "%3.0f.html" % f) for f in frequencies]
+        plot_file_list2 = []
+        for f in frequencies:
+            for d in dates:
+                # dates from the ini file may be written 01/07/2021 or 2021-01-07, the pages use the stored spelling
+                d = normalize_net_date(d)
+                c = d.split('/')
+                if len(c) != 3:
+                    raise ValueError(f'render date {d!r} is not a net date')
+                plot_file_list2.append((f, d, "%s%s%s%3.0f.html" % (c[2], c[0], c[1], f)))
+
+        for t in plot_file_list1:
+            if only is None or (float(t[0]), None) in only:
+                db.plot_all_stations_to_html(t[0], html_path=os.path.join(site_dir, t[1]), show_plots=False)
+        for t in plot_file_list2:
+            if only is None or (float(t[0]), t[1]) in only:
+                db.plot_all_stations_to_html(t[0], net_date=t[1], html_path=os.path.join(site_dir, t[2]),
+                                             show_plots=False)
+
+        with open(os.path.join(site_dir, 'index.html'), 'w') as fp:
+            fp.write("<html>\n<head>\n")
+            fp.write("<title> Reception Reports for ARES Simplex Net</title>")
+            fp.write("</head>\n<body>\n")
+            fp.write("<h1>Reception Maps Aggregated for all ARES Simplex Nets</h1>\n")
+            for t in plot_file_list1:
+                fp.write(f"\t<a target=\"_blank\" href=\"{t[1]}\"> {t[0]} MHz </a><br>\n")
+            fp.write("<h1>Reception Maps for individual ARES Simplex Nets</h1>\n")
+            fp.write("<p>Note that if there are no QSOs indicated a certain call sign map, ")
+            fp.write("that station may not have participated in that night\'s net.")
+            fp.write("So you might see a map for a night in which you did not participate, ")
+            fp.write("with no recorded QSOs.  That is normal.</p>")
+            for t in plot_file_list2:
+                fp.write(f"\t<a target=\"_blank\" href=\"{t[2]}\"> {t[1]} {t[0]} MHz </a><br>\n")
+            fp.write("</body>\n</html>\n")
+
+    def serve(self, port):
+        site_dir = self.config.get('render', 'site_dir', fallback='site')
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=site_dir)
+        with http.server.ThreadingHTTPServer(('', port), handler) as server:
+            print(f'serving {site_dir} on http://localhost:{port}/viewer.html')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+
+    def bench(self, repeat=3):
+        """time the hot paths against the configured database"""
+        db = self.open_database()
+        frequencies = config_list(self.config, 'render', 'frequencies', float) or [146.58]
+        frequency = frequencies[0]
+        station = db.home_station_information_df['Call'].iloc[0]
+        reader = srd(self.database_filename, read_only=True)
+        configured_cache = db.coverage_cache
+
+        def site_bundles():
+            with tempfile.TemporaryDirectory() as out_dir:
+                return db.export_site_bundles([frequency], out_dir=out_dir)
+
+        def coverage_grid():
+            # a fresh cache in memory each time, the grids kept in the configured cache directory are left alone
+            db.coverage_cache = CoverageCache()
+            return db.get_coverage_grid(station, frequency)
+
+        tasks = [
+            ('reception query, every station', lambda: [db.get_one_ham_reception_data(call, frequency)
+                                                        for call in db.home_station_information_df['Call']]),
+            ('reception arrays, every station', lambda: [db.get_reception_arrays(call, frequency)
+                                                         for call in db.home_station_information_df['Call']]),
+            ('reception arrays, read only', lambda: [reader.get_reception_arrays(call, frequency)
+                                                     for call in reader.home_station_information_df['Call']]),
+            ('station statistics', lambda: db.get_station_statistics(station, frequency)),
+            ('coverage grid', coverage_grid),
+            ('reciprocity', lambda: db.analyze_reciprocity(frequency)),
+            ('relay graph', lambda: db.relay_graph_cache.clear() or db.get_relay_graph(frequency)),
+            ('site bundles', site_bundles),
+        ]
+
+        try:
+            for name, task in tasks:
+                times = []
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    task()
+                    times.append(time.perf_counter() - start)
+                print(f'{name:35s} {min(times) * 1000:10.1f} ms')
+        finally:
+            db.coverage_cache = configured_cache
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ARES simplex net reception reports')
+    parser.add_argument('-c', '--config', default='simplex.ini', help='configuration file')
+    parser.add_argument('-f', '--force', action='store_true', help='run steps even if they look up to date')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sync_parser = subparsers.add_parser('sync', help='add new reports from the forms, then rollup and render')
+    sync_parser.add_argument('--watch', action='store_true', help='keep polling the forms, see form_watcher')
+    subparsers.add_parser('rebuild', help='recreate the database from the forms, then rollup and render')
+    subparsers.add_parser('render', help='rollup and render what is out of date')
+    serve_parser = subparsers.add_parser('serve', help='serve the site directory')
+    serve_parser.add_argument('-p', '--port', type=int, default=8000)
+    bench_parser = subparsers.add_parser('bench', help='time the main queries and renderers')
+    bench_parser.add_argument('-n', '--repeat', type=int, default=3)
+
+    args = parser.parse_args(argv)
+    runner = JobRunner(load_config(args.config), force=args.force)
+
+    if args.command in ('sync', 'rebuild'):
+        runner.run(args.command)
+        runner.run('render')
+        if args.command == 'sync' and args.watch:
+            from form_watcher import FormWatcher, SheetSource
+            found = sources(runner.config)
+            name, source = sorted(found.items())[0]
+            site_dir = runner.config.get('render', 'site_dir', fallback='site')
+            db = runner.open_database()
+            FormWatcher(db, SheetSource(*source),
+                        on_change=lambda affected: db.regenerate_outputs(affected, out_dir=site_dir),
+                        poll_interval=runner.config.getfloat('watch', 'poll_interval', fallback=60),
+                        debounce=runner.config.getfloat('watch', 'debounce', fallback=120)).run()
+    elif args.command == 'render':
+        runner.run('render')
+    elif args.command == 'serve':
+        runner.serve(args.port)
+    elif args.command == 'bench':
+        runner.bench(args.repeat)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
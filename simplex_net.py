@@ -21,26 +21,37 @@
 
 import re
 import os
-import sys
-import traceback
+import json
 import math
-import datetime
-import shutil
 
 import unicodedata
 import sqlite3
 # import sqlite
-import httplib2
-from apiclient import discovery
 import pandas as pd
 import numpy as np
-from bokeh.models import Dot, Circle, Asterisk, HoverTool, ColumnDataSource, LegendItem, Legend, Label
-from bokeh.plotting import figure, show
+from bokeh.models import Dot, Circle, Asterisk, HoverTool, ColumnDataSource, LegendItem, Legend, Label, \
+    LinearColorMapper
+from bokeh.palettes import RdYlGn9
+from bokeh.plotting import figure, show, save
 from bokeh.io import output_file
 # noinspection PyUnresolvedReferences
 from bokeh.tile_providers import get_provider, OSM
 from bokeh.layouts import gridplot
 
+from station_index import StationIndex
+from coverage_grid import CoverageCache, idw_grid, data_fingerprint
+import net_statistics
+import site_export
+import snapshots
+import reciprocity
+import quarantine
+from relay import RelayGraph
+import thumbnails
+import serving
+from sheet_fetcher import AsyncSheetFetcher, sheet_values_url
+from net_dates import NetWindow, normalize_net_date, net_day, date_condition
+from reception_quality import QUALITY_CODES
+
 
 class SimplexReportDatabase:
     """
@@ -48,13 +59,25 @@ class SimplexReportDatabase:
     """
     con = None
     home_station_information_df = None
+    station_index = None
+    location_check_df = None
+    coverage_cache = None
+    report_database_filename = None
+    snapshot_dir = None
+    relay_graph_cache = None
+    reception_queries = None
 
     def __init__(self, report_database_filename,
                  station_locations_filename=None,
                  spreadsheet_id=None,
                  range_name=None,
                  google_key=None,
-                 recreate_database=False):
+                 recreate_database=False,
+                 coverage_cache_dir=None,
+                 snapshot_dir=None,
+                 compress_snapshots=False,
+                 read_only=False,
+                 immutable=False):
         """
 
         :param str report_database_filename:  SQL file created by this class
@@ -64,21 +87,38 @@ class SimplexReportDatabase:
         :param str range_name:  range of google sheet to load
         :param str google_key:  google api key for sheets access
         :param bool recreate_database:  True to force replacement of database
+        :param str coverage_cache_dir:  directory to keep coverage grids between runs, None for memory only
+        :param str snapshot_dir:  directory for database snapshots, None to keep them next to the database
+        :param bool compress_snapshots:  True to gzip the snapshot taken before a recreate
+        :param bool read_only:  True to open an existing database for reading only, memory mapped,
+                    for rendering workers and servers, see serving.connect_read_only
+        :param bool immutable:  with read_only, True if nothing writes to the file while it is open
         """
+        if read_only and recreate_database:
+            raise ValueError('a database opened read only cannot be recreated')
+
+        self.coverage_cache = CoverageCache(coverage_cache_dir)
+        self.relay_graph_cache = {}
+        self.report_database_filename = report_database_filename
+        self.snapshot_dir = snapshot_dir
+
         if recreate_database:
-            if os.path.exists(report_database_filename):
-                n = datetime.datetime.today()
-                backup_database_filename = report_database_filename+'%4d%02d%02d%02d%02d%02d' \
-                    % (n.year, n.month, n.day, n.hour, n.minute, n.second)
-                shutil.copy(report_database_filename, backup_database_filename)
-                os.remove(report_database_filename)
+            # snapshot the old database online, it is then emptied in place rather than deleted
+            # so other processes with it open are not left holding a removed file
+            self.create_snapshot(compress=compress_snapshots)
 
             hams = self.read_station_information_file(station_locations_filename)
             form_data = self.get_form_results(spreadsheet_id, range_name, google_key)
             self.initialize_new_database(hams, report_database_filename)
             self.populate_database_with_reports(form_data)
+            self.coverage_cache.clear()
+        elif read_only:
+            # the tables are used as they are, open the database read write once to upgrade an older file
+            self.con = serving.connect_read_only(report_database_filename, immutable=immutable)
         else:
             self.con = sqlite3.connect(report_database_filename)
+            # add any tables an older database file does not have yet
+            self.create_tables()
 
         self.read_all_base_station_information()
         self.wgs84_to_web_mercator()
@@ -105,18 +145,14 @@ class SimplexReportDatabase:
 
     @staticmethod
     def get_form_results(spreadsheet_id, range_name, key):
-        discovery_url = ('https://sheets.googleapis.com/$discovery/rest?'
-                         'version=v4')
-        service = discovery.build(
-            'sheets',
-            'v4',
-            http=httplib2.Http(),
-            discoveryServiceUrl=discovery_url,
-            developerKey=key)
-
-        result = service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id, range=range_name).execute()
-        values = result.get('values', [])
+        fetcher = AsyncSheetFetcher()
+        try:
+            values = fetcher.fetch_all({'form': sheet_values_url(spreadsheet_id, range_name, key)})['form']
+        finally:
+            fetcher.close()
+
+        if isinstance(values, Exception):
+            raise values
 
         if not values:
             print('No data found.')
@@ -130,24 +166,72 @@ class SimplexReportDatabase:
         self.con = sqlite3.connect(report_database_filename)
         cur = self.con.cursor()
 
-        cur.execute("CREATE TABLE Hams (Id INT, Call TINYTEXT, Latitude FLOAT, Longitude FLOAT)")
+        for table in ['Hams', 'RESPONSES', 'NET_METADATA', 'NET_STATISTICS', 'QUARANTINE']:
+            cur.execute(f"DROP TABLE IF EXISTS {table}")
 
-        for item in enumerate(station_list):
-            data = item[1]
-            command = "INSERT INTO Hams VALUES({}, '{}', {}, {})".format(item[0],
-                                                                         data['Call'],
-                                                                         data['Latitude'], data['Longitude'])
-            cur.execute(command)
+        self.create_tables()
+        self.write_station_information(station_list)
+
+    def create_tables(self):
+        """create the tables of the database that do not exist yet"""
+        cur = self.con.cursor()
+
+        cur.execute("CREATE TABLE IF NOT EXISTS Hams (Id INT, Call TINYTEXT, Latitude FLOAT, Longitude FLOAT)")
 
         cur.execute(
-            "CREATE TABLE RESPONSES (Id TEXT, ReportingTimestamp DATETIME, ReportingStation TINYTEXT, " +
+            "CREATE TABLE IF NOT EXISTS RESPONSES (Id TEXT, ReportingTimestamp DATETIME, ReportingStation TINYTEXT, " +
             "DateOfNet DATE, FrequencyOfNet FLOAT, " +
             "TransmittingStation TINYTEXT, TransmittingStationPower FLOAT, TransmittingStationHeight FLOAT, " +
             "TransmittingStationLatitude FLOAT, TransmittingStationLongitude FLOAT, " +
             "ReceivingStation TINYTEXT, QSOQuality TINYTEXT, ReceivingStationHeight TINYTEXT, " +
-            "ReceivingStationLatitude FLOAT, ReceivingStationLongitude FLOAT)"
+            "ReceivingStationLatitude FLOAT, ReceivingStationLongitude FLOAT, NetDay TEXT)"
         )
 
+        # databases from before net dates were normalized get the NetDay column filled in below
+        columns = [row[1] for row in cur.execute("PRAGMA table_info(RESPONSES)")]
+        upgrade = 'NetDay' not in columns
+        if upgrade:
+            cur.execute("ALTER TABLE RESPONSES ADD COLUMN NetDay TEXT")
+
+        # date filters, single nets as well as windows, go through NetDay
+        cur.execute("CREATE INDEX IF NOT EXISTS RESPONSES_NetDay ON RESPONSES (FrequencyOfNet, NetDay)")
+        cur.execute("CREATE INDEX IF NOT EXISTS RESPONSES_TransmittingStation_NetDay " +
+                    "ON RESPONSES (TransmittingStation, FrequencyOfNet, NetDay)")
+
+        self.con.commit()
+
+        self.create_net_metadata_table()
+        quarantine.create_quarantine_table(self.con)
+        if upgrade:
+            self.normalize_stored_net_dates()
+        if net_statistics.create_net_statistics_table(self.con) or upgrade:
+            self.update_net_statistics()
+
+    def normalize_stored_net_dates(self):
+        """rewrite the net dates already in the database in normalized form and fill in NetDay"""
+        cur = self.con.cursor()
+
+        for (stored,) in cur.execute("SELECT DISTINCT DateOfNet FROM RESPONSES").fetchall():
+            cur.execute("UPDATE RESPONSES SET DateOfNet=?, NetDay=? WHERE DateOfNet=?",
+                        (normalize_net_date(stored), net_day(stored), stored))
+
+        # the same net typed two ways collapses to one row, the later one wins
+        for (stored,) in cur.execute("SELECT DISTINCT DateOfNet FROM NET_METADATA").fetchall():
+            cur.execute("UPDATE OR REPLACE NET_METADATA SET DateOfNet=? WHERE DateOfNet=?",
+                        (normalize_net_date(stored), stored))
+
+        self.con.commit()
+
+    def write_station_information(self, station_list):
+        """replace the contents of the Hams table
+
+        :param list station_list: dicts with Call, Latitude and Longitude, see read_station_information_file
+        """
+        cur = self.con.cursor()
+        cur.execute("DELETE FROM Hams")
+        cur.executemany("INSERT INTO Hams VALUES(?, ?, ?, ?)",
+                        [(i, data['Call'], data['Latitude'], data['Longitude'])
+                         for i, data in enumerate(station_list)])
         self.con.commit()
 
     def update_station_information(self, call_sign, latitude, longitude):
@@ -252,6 +336,9 @@ class SimplexReportDatabase:
         # call sign should not have trailing blanks
         report[1] = report[1].strip()
 
+        # one spelling per net date, 01/07/2021 and 1/7/2021 are the same net
+        report[2] = normalize_net_date(report[2])
+
         report[5] = re.sub('[\']', ' ft', report[5])
         report[5] = re.sub('[\"]', ' in', report[5])
 
@@ -304,12 +391,9 @@ class SimplexReportDatabase:
                 report[5] = None
 
         for i, item in enumerate(report):
-            if '\'' in item:
+            if isinstance(item, str) and '\'' in item:
                 # remove any stray ' or " which will mess up the SQL command
-                new_item = re.sub('[\'\"]', '', item)
-                print(f'replaced {item} with {new_item}')
-
-                report[i] = new_item
+                report[i] = re.sub('[\'\"]', '', item)
 
         return report
 
@@ -326,114 +410,481 @@ class SimplexReportDatabase:
         8 Comments - of receiving station submitting the report
         9 onwards are the reception quality of the call signs listed in the report form
 
-        The reports are cycled through twice.  First to populate them into the database.
-        The second time is to look up the transmitting station and update the power, height and location
-        specific to each unique simplex net test, where there is a unique date, transmitting station and net frequency
+        The reports are cycled through once to populate them into the database.
+        Then the power, height and location of each reporting station, as the transmitting station
+        of that net, are resolved in bulk into NET_METADATA, specific to each unique simplex net test
+        where there is a unique date, transmitting station and net frequency, and written to RESPONSES
+
+        Rows that cannot be ingested are set aside in the QUARANTINE table with a reason code,
+        see the quarantine module, and the rest of the batch carries on.
+
+        :return: list of the cleaned reports written to RESPONSES
         """
         cur = self.con.cursor()
 
         header = form_data[0]
-        reports = form_data[1:]
+        idx_first_call = next((i for i, name in enumerate(header) if '[' in name and ']' in name), None)
+        if idx_first_call is None:
+            raise ValueError('no call sign columns, e.g. [W1FX], in the form header')
+
+        # screen the whole batch first, rows are kept as received for the quarantine
+        received = quarantine.pad_reports(header, form_data[1:])
+        problems = quarantine.screen_reports(header, received, idx_first_call)
+        rejected = [(report,) + problem for report, problem in zip(received, problems) if problem is not None]
+
+        reports = []
+        sources = []
+        for report, problem in zip(received, problems):
+            if problem is not None:
+                continue
+            try:
+                reports.append(self.clean_up_report(list(report)))
+                sources.append(report)
+            except (ValueError, TypeError, IndexError, AttributeError) as er:
+                rejected.append((report, 'clean_up_failed', str(er)))
+
+        # check every reported location against the base stations in one pass
+        station_index = self.build_station_index()
+        location_check_df = station_index.validate_locations([report[1] for report in reports],
+                                                             [report[6] for report in reports],
+                                                             [report[7] for report in reports])
+
+        # a station that is not in the Hams table and gave no location cannot be put on the map
+        unplaced = ((location_check_df['Status'] == 'unknown') & location_check_df['Latitude'].isna()).to_numpy()
+        rejected.extend((source, 'unknown_location', '' if suggestion is None else f'did you mean {suggestion}?')
+                        for source, suggestion, bad in zip(sources, location_check_df['SuggestedCall'], unplaced)
+                        if bad)
+        reports = [report for report, bad in zip(reports, unplaced) if not bad]
+        sources = [source for source, bad in zip(sources, unplaced) if not bad]
+        self.location_check_df = location_check_df[~unplaced].reset_index(drop=True)
+        self.print_location_check_summary()
+
+        # each report goes in whole or not at all, inside one transaction for the batch
+        inserted = []
+        cur.execute("SAVEPOINT batch")
+        try:
+            for clean_report, source, location in zip(reports, sources, self.location_check_df.itertuples()):
 
-        for report in reports:
+                # takes the call signs of the header and pairs them with the reception quality in the report
+                reception_ratings, idx_start = self.build_reception_dict(header, clean_report)
+                record_id = self.build_record_id(clean_report[2], clean_report[1], clean_report[3])
+                day = net_day(clean_report[2])
 
-            clean_report = self.clean_up_report(report)
+                # reporting (e.g. receiving) station location as reported, snapped to or taken from the Hams table
+                if location.Status != 'unknown':
+                    clean_report[6] = location.Latitude
+                    clean_report[7] = location.Longitude
 
-            # takes the call signs of the header and pairs them with the reception quality in the report
-            reception_ratings, idx_start = self.build_reception_dict(header, clean_report)
-            record_id = self.build_record_id(clean_report[2], clean_report[1], clean_report[3])
+                # TODO the problem with this is it looks up the base station information, and does
+                # not account for a ham that might be mobile
+                transmitting_latitudes, transmitting_longitudes = station_index.location_of(reception_ratings.keys())
+
+                commands = []
+                for transmitting_station, transmitting_station_latitude, transmitting_station_longitude in zip(
+                        reception_ratings.keys(), transmitting_latitudes, transmitting_longitudes):
+
+                    if np.isnan(transmitting_station_latitude):
+                        transmitting_station_latitude = None
+                        transmitting_station_longitude = None
+
+                    command = "INSERT INTO RESPONSES (Id, ReportingTimestamp, ReportingStation, " +\
+                              "DateOfNet, FrequencyOfNet, " +\
+                              "TransmittingStation, TransmittingStationPower, TransmittingStationHeight, " +\
+                              "TransmittingStationLatitude, TransmittingStationLongitude, " +\
+                              "ReceivingStation, QSOQuality, ReceivingStationHeight, " +\
+                              "ReceivingStationLatitude, ReceivingStationLongitude, NetDay) " +\
+                              "VALUES ('{}','{}','{}','{}',{},'{}','{}','{}','{}','{}','{}','{}','{}','{}','{}',{})"\
+                              .format(
+                                record_id, clean_report[0], clean_report[1],
+                                clean_report[2], clean_report[3],
+                                transmitting_station, None, None,
+                                transmitting_station_latitude, transmitting_station_longitude,
+                                clean_report[1], reception_ratings[transmitting_station], clean_report[5],
+                                clean_report[6], clean_report[7],
+                                'NULL' if day is None else f"'{day}'")
+
+                    commands.append(command)
+
+                cur.execute("SAVEPOINT report")
+                try:
+                    for command in commands:
+                        cur.execute(command)
+                except sqlite3.Error as er:
+                    cur.execute("ROLLBACK TO report")
+                    rejected.append((source, 'insert_failed', ' '.join(er.args)))
+                else:
+                    inserted.append(location.Index)
+                cur.execute("RELEASE report")
+        except BaseException:
+            # nothing of a batch that fails part way through is kept
+            cur.execute("ROLLBACK TO batch")
+            cur.execute("RELEASE batch")
+            raise
+
+        cur.execute("RELEASE batch")
+        self.con.commit()
 
-            # add reporting (e.g. receiving) station location from the Hams table if not given in the report
-            if (len(clean_report[6]) == 0) | (len(clean_report[7]) == 0):
-                ham_info = self.get_one_base_station_information(clean_report[1])
+        quarantine.quarantine_reports(self.con, header, rejected)
+        if len(rejected) > 0:
+            print(quarantine.summary_line(len(received), rejected))
 
-                if ham_info is not None:
-                    clean_report[6] = ham_info[2]
-                    clean_report[7] = ham_info[3]
+        reports = [reports[i] for i in inserted]
+        self.location_check_df = self.location_check_df.iloc[inserted].reset_index(drop=True)
 
-            for transmitting_station in reception_ratings.keys():
-                # TODO the problem with this is it looks up the base station information, and does
-                # not account for a ham that might be mobile
-                ham_info = self.get_one_base_station_information(transmitting_station)
+        # each reporting station is the transmitting station of that net, resolve its power, height and
+        # location once per net and write them to all of its RESPONSES rows in one statement
+        nets = set((float(report[3]), report[2]) for report in reports)
+        self.store_net_metadata(self.resolve_net_metadata(reports, self.location_check_df), nets)
 
-                if ham_info is None:
-                    transmitting_station_latitude = None
-                    transmitting_station_longitude = None
-                else:
-                    transmitting_station_latitude = ham_info[2]
-                    transmitting_station_longitude = ham_info[3]
-
-                command = "INSERT INTO RESPONSES (Id, ReportingTimestamp, ReportingStation, " +\
-                          "DateOfNet, FrequencyOfNet, " +\
-                          "TransmittingStation, TransmittingStationPower, TransmittingStationHeight, " +\
-                          "TransmittingStationLatitude, TransmittingStationLongitude, " +\
-                          "ReceivingStation, QSOQuality, ReceivingStationHeight, " +\
-                          "ReceivingStationLatitude, ReceivingStationLongitude) " +\
-                          "VALUES ('{}','{}','{}','{}',{},'{}','{}','{}','{}','{}','{}','{}','{}','{}','{}')".format(
-                            record_id, clean_report[0], clean_report[1],
-                            clean_report[2], clean_report[3],
-                            transmitting_station, None, None,
-                            transmitting_station_latitude, transmitting_station_longitude,
-                            clean_report[1], reception_ratings[transmitting_station], clean_report[5],
-                            clean_report[6], clean_report[7])
+        # refresh the rollups of the nets in this batch only
+        self.update_net_statistics(nets)
 
-                try:
-                    cur.execute(command)
-                except sqlite3.Error as er:
-                    print('SQLite error: %s' % (' '.join(er.args)))
-                    print("Exception class is: ", er.__class__)
-                    print('SQLite traceback: ')
-                    exc_type, exc_value, exc_tb = sys.exc_info()
-                    print(traceback.format_exception(exc_type, exc_value, exc_tb))
-                    print(command)
+        # relay graphs are built from the reports, rebuild them on next use
+        self.relay_graph_cache = {}
 
+        return reports
+
+    def create_net_metadata_table(self):
+        """one row per (transmitting station, frequency, net date) with the station's power, height and location"""
+        self.con.execute("CREATE TABLE IF NOT EXISTS NET_METADATA (TransmittingStation TINYTEXT, " +
+                         "FrequencyOfNet FLOAT, DateOfNet DATE, Power FLOAT, Height FLOAT, " +
+                         "Latitude FLOAT, Longitude FLOAT, " +
+                         "PRIMARY KEY (TransmittingStation, FrequencyOfNet, DateOfNet))")
         self.con.commit()
 
-        # we go through the reports and update for transmit height and power,
-        for report in reports:
-            transmitting_station = report[1]
-            transmit_power = report[4]
-            transmit_height = report[5]
+    @staticmethod
+    def resolve_net_metadata(reports, location_check_df):
+        """transmitting station metadata per net from a batch of cleaned reports
 
-            ham_info = self.get_one_base_station_information(transmitting_station)
+        The power and height are the leading number of what was entered, e.g. '50 W' or '100 ft'.
+        If a station reported more than once for the same net its last report wins.
 
-            if ham_info is not None:
-                if report[6] is None or report[6] == '' or report[6] == 0:
-                    transmit_latitude = ham_info[2]
-                if report[7] is None or report[7] == '' or report[7] == 0:
-                    transmit_longitude = ham_info[3]
+        :param list reports: cleaned reports, see populate_database_with_reports
+        :param location_check_df: result of StationIndex.validate_locations for the same reports
+        :return: DataFrame with the NET_METADATA columns, stations without a known location left out
+        """
+        number = r'([-+]?\d*\.?\d+)'
+        df = pd.DataFrame({
+            'TransmittingStation': [report[1] for report in reports],
+            'FrequencyOfNet': pd.to_numeric(pd.Series([report[3] for report in reports], dtype=object),
+                                            errors='coerce'),
+            'DateOfNet': [report[2] for report in reports],
+            'Power': pd.Series([str(report[4]) for report in reports]).str.extract(number)[0].astype(float),
+            'Height': pd.Series([str(report[5]) for report in reports]).str.extract(number)[0].astype(float),
+            'Latitude': location_check_df['Latitude'].to_numpy(),
+            'Longitude': location_check_df['Longitude'].to_numpy(),
+        })
+        df = df[(location_check_df['Status'] != 'unknown').to_numpy() & df['FrequencyOfNet'].notna().to_numpy()]
+
+        return df.drop_duplicates(['TransmittingStation', 'FrequencyOfNet', 'DateOfNet'], keep='last')
+
+    def store_net_metadata(self, metadata_df, nets=None):
+        """save net metadata and materialize it into the RESPONSES rows of the nets in a batch
+
+        :param metadata_df: DataFrame from resolve_net_metadata
+        :param nets: (frequency, net date) pairs whose RESPONSES rows were added, default those in metadata_df.
+            Rows added for a station whose metadata came in an earlier batch are filled in too.
+        """
+        self.create_net_metadata_table()
+        cur = self.con.cursor()
 
-                # check location within a certain radius of base station
-                if self.haversine((float(report[6]), float(report[6])), (ham_info[2], ham_info[3])) > 100:
-                    transmit_latitude = report[6]
-                    transmit_longitude = report[7]
-                else:
-                    transmit_latitude = ham_info[2]
-                    transmit_longitude = ham_info[3]
+        if nets is None:
+            nets = set(zip(metadata_df['FrequencyOfNet'], metadata_df['DateOfNet']))
 
-                # find the reporting station amongst the transmitting stations for a given net date and net frequency
-                command_str = "UPDATE RESPONSES SET " +\
-                              "TransmittingStationPower=?, TransmittingStationHeight=?, " +\
-                              "TransmittingStationLatitude=?, TransmittingStationLongitude=? " +\
-                              "WHERE TransmittingStation=? AND DateOfNet=? AND FrequencyOfNet=?"
+        rows = metadata_df.astype(object).where(metadata_df.notna(), None).itertuples(index=False, name=None)
+        cur.executemany("INSERT OR REPLACE INTO NET_METADATA VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
 
-                try:
-                    cur.execute(command_str, (transmit_power, transmit_height, transmit_latitude, transmit_longitude,
-                                              transmitting_station, report[2], report[3]))
-                except sqlite3.Error as er:
-                    print('SQLite error: %s' % (' '.join(er.args)))
-                    print("Exception class is: ", er.__class__)
-                    print('SQLite traceback: ')
-                    exc_type, exc_value, exc_tb = sys.exc_info()
-                    print(traceback.format_exception(exc_type, exc_value, exc_tb))
-                    print(command_str)
-            else:
-                print(f'need location info for {transmitting_station}, record not updated')
+        cur.execute("CREATE TEMP TABLE IF NOT EXISTS touched_nets (FrequencyOfNet FLOAT, DateOfNet DATE)")
+        cur.execute("DELETE FROM touched_nets")
+        cur.executemany("INSERT INTO touched_nets VALUES (?, ?)", sorted(nets))
 
+        match = "WHERE m.TransmittingStation = RESPONSES.TransmittingStation " +\
+                "AND m.FrequencyOfNet = RESPONSES.FrequencyOfNet AND m.DateOfNet = RESPONSES.DateOfNet"
+        cur.execute("UPDATE RESPONSES SET (TransmittingStationPower, TransmittingStationHeight, " +
+                    "TransmittingStationLatitude, TransmittingStationLongitude) = " +
+                    f"(SELECT Power, Height, Latitude, Longitude FROM NET_METADATA m {match}) " +
+                    "WHERE (FrequencyOfNet, DateOfNet) IN (SELECT FrequencyOfNet, DateOfNet FROM touched_nets) " +
+                    f"AND EXISTS (SELECT 1 FROM NET_METADATA m {match})")
         self.con.commit()
 
+    def get_net_metadata(self, station=None, frequency=None):
+        """power, height and location each station used at each net"""
+        command = "SELECT * FROM NET_METADATA"
+        conditions = []
+        parameters = []
+        if station is not None:
+            conditions.append("TransmittingStation=?")
+            parameters.append(station)
+        if frequency is not None:
+            conditions.append("FrequencyOfNet=?")
+            parameters.append(float(frequency))
+        if len(conditions) > 0:
+            command = command + " WHERE " + " AND ".join(conditions)
+
+        return pd.read_sql(command, self.con, params=parameters)
+
+    @staticmethod
+    def report_key(report):
+        """(timestamp, call sign) identifying a form submission, the call cleaned as clean_up_report does"""
+        call_str = str(report[1]).split() if len(report) > 1 else []
+        call = call_str[0].upper() if len(call_str) > 0 else ''
+
+        return str(report[0]) if len(report) > 0 else '', call
+
+    def append_new_reports(self, form_data):
+        """ingest only the form submissions not already in the database
+
+        :param list form_data: all rows of the form, header first
+        :return: set of (station, frequency, net date) whose reception data changed
+        """
+        cur = self.con.cursor()
+        # submissions in quarantine count as seen, they come back through reprocess_quarantine
+        cur.execute("SELECT ReportingTimestamp, ReportingStation FROM RESPONSES " +
+                    "UNION SELECT ReportingTimestamp, ReportingStation FROM QUARANTINE")
+        existing = set(cur.fetchall())
+
+        header = form_data[0]
+        new_reports = [report for report in form_data[1:] if self.report_key(report) not in existing]
+        if len(new_reports) == 0:
+            return set()
+
+        added = self.populate_database_with_reports([header] + new_reports)
+
+        # every station the new reports rated, and the reporting stations whose transmit metadata changed
+        affected = set()
+        for report in added:
+            frequency = float(report[3])
+            reception_ratings, idx_start = self.build_reception_dict(header, report)
+            affected.update((station, frequency, report[2])
+                            for station, quality in reception_ratings.items() if len(quality) > 0)
+            affected.add((report[1], frequency, report[2]))
+
+        print(f'added {len(added)} new reports')
+
+        return affected
+
+    def get_quarantine(self, reason=None):
+        """form rows set aside at ingest
+
+        :param str reason: only rows set aside for this reason, see quarantine.REASONS, None for all
+        :return: DataFrame with Id, QuarantinedAt, Reason, Detail, ReportingTimestamp, ReportingStation,
+            Header and Report, the last two the form header and the row as received
+        """
+        return quarantine.read_quarantine(self.con, reason)
+
+    def print_quarantine_summary(self):
+        """one line per reason with the number of rows in quarantine and a few examples"""
+        df = self.get_quarantine()
+        for reason, group in df.groupby('Reason', sort=False):
+            examples = ', '.join(f'{row.ReportingStation or "?"} {row.Detail}'.strip()
+                                 for row in group.head(3).itertuples())
+            print(f'{reason}: {len(group)} rows, {quarantine.REASONS.get(reason, "")}, e.g. {examples}')
+
+    def reprocess_quarantine(self, ids=None, reason=None, fix=None):
+        """ingest quarantined rows again once the cause has been fixed
+
+        Rows that still fail go back into quarantine.
+
+        :param ids: quarantine ids to take out, None for all
+        :param str reason: only rows set aside for this reason, None for all
+        :param fix: called as fix(header, report) for each row, returning the corrected row,
+            None when the fix was made elsewhere, e.g. in the Hams table
+        :return: set of (station, frequency, net date) touched
+        """
+        df = self.get_quarantine(reason)
+        if ids is not None:
+            df = df[df['Id'].isin(list(ids))]
+
+        affected = set()
+        # rows of different forms keep their own header
+        for header_text, group in df.groupby(df['Header'].map(json.dumps), sort=False):
+            header = group['Header'].iloc[0]
+            reports = [report if fix is None else fix(header, report) for report in group['Report']]
+
+            # the rows leave quarantine in the same transaction that ingests them again,
+            # so a failure leaves them where they were
+            try:
+                quarantine.release_reports(self.con, group['Id'])
+                affected.update(self.append_new_reports([header] + reports))
+                self.con.commit()
+            except BaseException:
+                self.con.rollback()
+                raise
+
+        return affected
+
+    def regenerate_outputs(self, affected, out_dir='site', coverage=False):
+        """rebuild only the outputs touched by new reports
+
+        :param set affected: (station, frequency, net date) as returned by append_new_reports
+        :param str out_dir: directory of the data-only site
+        :param bool coverage: True to also refresh the cached coverage grids of the affected stations
+        :return: list of site file names written
+        """
+        frequencies = sorted(set(frequency for station, frequency, net_date in affected))
+        nets = set((frequency, net_date) for station, frequency, net_date in affected)
+        # the all-nets bundle of each frequency changes too
+        nets.update((frequency, None) for frequency in frequencies)
+
+        changed = self.export_site_bundles(frequencies, out_dir=out_dir, only=nets)
+
+        if coverage:
+            known = set(self.home_station_information_df['Call'])
+            for station, frequency, net_date in affected:
+                if station in known:
+                    self.get_coverage_grid(station, frequency, net_date)
+                    self.get_coverage_grid(station, frequency)
+
+        return changed
+
+    def sync_sources(self, urls, fetcher=None):
+        """fetch several form sources at once and ingest each one's new reports as soon as it arrives
+
+        :param dict urls: source name -> URL, see sheet_fetcher.sheet_values_url
+        :param fetcher: AsyncSheetFetcher to reuse, so its connections and conditional request state carry over
+        :return: set of (station, frequency, net date) touched
+        """
+        own_fetcher = fetcher is None
+        if own_fetcher:
+            fetcher = AsyncSheetFetcher()
+
+        affected = set()
+
+        def ingest(name, form_data):
+            if form_data is not None and len(form_data) > 1:
+                affected.update(self.append_new_reports(form_data))
+
+        try:
+            results = fetcher.fetch_all(urls, on_result=ingest)
+        finally:
+            if own_fetcher:
+                fetcher.close()
+
+        for name, values in results.items():
+            if isinstance(values, Exception):
+                print(f'{name}: {values}')
+
+        return affected
+
+    def build_station_index(self, cell_size=0.25):
+        """build the spatial index over the Hams table
+
+        :param float cell_size: grid cell size in degrees
+        :return: StationIndex
+        """
+        hams = pd.read_sql("SELECT Call, Latitude, Longitude FROM Hams", self.con)
+        self.station_index = StationIndex.from_dataframe(hams, cell_size=cell_size)
+
+        return self.station_index
+
+    def print_location_check_summary(self):
+        """one compact summary of the location checks from the last ingest instead of a line per row"""
+        if self.location_check_df is None or len(self.location_check_df) == 0:
+            return
+
+        counts = self.location_check_df['Status'].value_counts()
+        print('report locations: ' + ', '.join(f'{n} {status}' for status, n in counts.items()))
+
+        # one line per kind of problem however many stations have it
+        unknown = self.location_check_df[self.location_check_df['Status'] == 'unknown'].drop_duplicates('Call')
+        if len(unknown) > 0:
+            print('not in the list of ham locations: ' +
+                  ', '.join(f'{row.Call} (did you mean {row.SuggestedCall}?)' for row in unknown.itertuples()))
+
+        implausible = self.location_check_df[self.location_check_df['Status'] == 'implausible']
+        implausible = implausible.drop_duplicates('Call')
+        if len(implausible) > 0:
+            print('implausible locations, base station used: ' +
+                  ', '.join(f'{row.Call} ({row.NearestDistance / 1000:.0f} km from {row.NearestCall})'
+                            for row in implausible.itertuples()))
+
+    def update_net_statistics(self, nets=None):
+        """recompute the per net station statistics
+
+        :param nets: iterable of (frequency, net date) pairs, None to rebuild all of them
+        :return: number of rollup rows written
+        """
+        return net_statistics.update_net_statistics(self.con, nets)
+
+    def get_station_statistics(self, station=None, frequency=None, net_date=None):
+        """per net statistics of how well stations were heard, from the rollup table
+
+        :param str station: transmitting station call sign, None for all stations
+        :param float frequency: None for all frequencies
+        :param net_date: date of simplex net, a list of dates, a NetWindow, or None for all nets
+        :return: DataFrame ordered by net date
+        """
+        return net_statistics.read_net_statistics(self.con, station, frequency, net_date)
+
+    def plot_station_statistics(self, station, frequency):
+        """plot how often a station was heard G/R, W/R and N/C at each net
+
+        :param str station: transmitting station call sign
+        :param float frequency:
+        :return object: bokeh plot object
+        """
+        df = self.get_station_statistics(station, frequency)
+        source = ColumnDataSource(df)
+
+        p = figure(title=f'how well {station} was heard on {frequency}', x_axis_type='datetime',
+                   tools='wheel_zoom,pan,reset,save', width=500, height=300)
+
+        for column, color, label in [('GoodCount', 'green', 'G/R'),
+                                     ('WeakCount', 'orange', 'W/R'),
+                                     ('NoContactCount', 'red', 'N/C')]:
+            p.line(x='NetDate', y=column, source=source, line_color=color, legend_label=label)
+            p.circle(x='NetDate', y=column, source=source, color=color, legend_label=label)
+
+        p.add_tools(HoverTool(tooltips=[('net', '@DateOfNet'), ('G/R', '@GoodCount'), ('W/R', '@WeakCount'),
+                                        ('N/C', '@NoContactCount'), ('receivers', '@Receivers'),
+                                        ('max distance, m', '@MaxDistance{0}'), ('power, W', '@TransmitPower')]))
+        p.yaxis.axis_label = 'reports'
+        p.legend.location = 'top_left'
+
+        return p
+
+    def create_snapshot(self, compress=False, force=False, keep_last=5, keep_daily=7, keep_monthly=12):
+        """take an online snapshot of the database and thin out old snapshots
+
+        :param bool compress: True to gzip the snapshot
+        :param bool force: True to take a snapshot even if the database did not change since the last one
+        :param int keep_last: number of most recent snapshots always kept
+        :param int keep_daily: days for which the newest snapshot of the day is kept
+        :param int keep_monthly: months for which the newest snapshot of the month is kept
+        :return: file name of the snapshot, None if there is no database yet
+        """
+        snapshot_filename = snapshots.create_snapshot(self.report_database_filename, self.snapshot_dir,
+                                                      compress=compress, force=force)
+        if snapshot_filename is not None:
+            snapshots.apply_retention(self.report_database_filename, self.snapshot_dir,
+                                      keep_last=keep_last, keep_daily=keep_daily, keep_monthly=keep_monthly)
+
+        return snapshot_filename
+
+    def list_snapshots(self):
+        """snapshots of this database, oldest first, as (datetime, file name)"""
+        return snapshots.list_snapshots(self.report_database_filename, self.snapshot_dir)
+
+    def restore_snapshot(self, snapshot_filename=None):
+        """replace the database contents with a snapshot, the newest one by default"""
+        if snapshot_filename is None:
+            snapshot_filename = self.list_snapshots()[-1][1]
+
+        if self.con is not None:
+            self.con.close()
+        snapshots.restore_snapshot(snapshot_filename, self.report_database_filename)
+        self.con = sqlite3.connect(self.report_database_filename)
+        # a snapshot taken by an older version lacks the newer columns and tables
+        self.create_tables()
+
+        self.read_all_base_station_information()
+        self.wgs84_to_web_mercator()
+        self.coverage_cache.clear()
+        self.relay_graph_cache = {}
+
     def __del__(self):
-        self.con.close()
+        if self.con is not None:
+            self.con.close()
 
     def read_all_base_station_information(self):
         # TODO with here may close the data file prematurely in normal operations
@@ -444,6 +895,9 @@ class SimplexReportDatabase:
         self.home_station_information_df['Longitude'] = self.home_station_information_df['Longitude'].astype('float')
         self.home_station_information_df = self.home_station_information_df.drop(columns='Id')
 
+        self.station_index = StationIndex.from_dataframe(self.home_station_information_df)
+        self.reception_queries = None
+
     def get_one_base_station_information(self, call):
         """fetch information for one or all stations"""
         cur = self.con.cursor()
@@ -464,39 +918,67 @@ class SimplexReportDatabase:
 
     def get_one_ham_reception_data(self, ham, frequency, net_date=None):
         """Fetch data from the database and arrange appropriately for mapping in a pandas dataframe
+
+        :param net_date: date of simplex net padded or not, a list of dates, a NetWindow, or None for all nets
         """
+        command = "SELECT * from RESPONSES WHERE TransmittingStation=? AND FrequencyOfNet=?"
+        parameters = [ham, float(frequency)]
+        condition, window_parameters = date_condition(net_date, frequency)
+        if condition is not None:
+            command = command + " AND " + condition
+            parameters.extend(window_parameters)
+
         # TODO with here may close the data file prematurely in normal operations
         with self.con:
-            if net_date is None:
-                command = \
-                    f"SELECT * from RESPONSES WHERE (TransmittingStation ='{ham}' AND FrequencyOfNet ={frequency})"
-            else:
-                command = \
-                    f"SELECT * from RESPONSES WHERE (TransmittingStation='{ham}' AND FrequencyOfNet={frequency}" +\
-                    f" AND DateOfNet=\'{net_date}\')"
-
-            # print(command)
-            df = pd.read_sql(command, self.con)
+            df = pd.read_sql(command, self.con, params=parameters)
 
         return df
 
+    def get_reception_arrays(self, ham, frequency, net_date=None):
+        """who heard a station, how well and where, as NumPy arrays for the map glyph sources
+
+        :param str ham: transmitting station call sign
+        :param float frequency:
+        :param net_date: date of simplex net, a list of dates, a NetWindow, or None for all nets
+        :return: dict of arrays, see serving.ReceptionQueries.reception
+        """
+        if self.reception_queries is None:
+            self.reception_queries = serving.ReceptionQueries(self.con, self.home_station_information_df)
+
+        return self.reception_queries.reception(ham, frequency, net_date)
+
+    def list_net_dates(self, frequency=None, net_date=None):
+        """dates of the nets in the database, oldest first
+
+        :param float frequency: None for nets on any frequency
+        :param net_date: a list of dates or a NetWindow to list only those nets, None for all of them
+        :return: list of net dates as stored, m/d/yyyy
+        """
+        conditions = ["NetDay IS NOT NULL"]
+        parameters = []
+        if frequency is not None:
+            conditions.append("FrequencyOfNet=?")
+            parameters.append(float(frequency))
+        condition, window_parameters = date_condition(net_date, frequency)
+        if condition is not None:
+            conditions.append(condition)
+            parameters.extend(window_parameters)
+
+        cur = self.con.execute("SELECT DateOfNet FROM RESPONSES WHERE " + " AND ".join(conditions) +
+                               " GROUP BY NetDay ORDER BY NetDay", parameters)
+
+        return [row[0] for row in cur.fetchall()]
+
     @staticmethod
     def add_reception_scaled_value(df, scale):
         """Translate ARES reception string to a numeral appropriate to the plot's scale"""
-        coding = {
-            'N/A': None,
-            'G/R': 4,
-            'W/R': 2,
-            'N/C': 0,
-            '': None
-        }
-
         n = []
         for s in df['QSOQuality']:
-            if coding[s] is None:
-                n.append(coding[s])
+            # N/A and blank have no code
+            if QUALITY_CODES.get(s) is None:
+                n.append(None)
             else:
-                n.append(coding[s] * scale)
+                n.append(QUALITY_CODES[s] * scale)
 
         df['ReceivedQualityValue'] = n
 
@@ -509,6 +991,7 @@ class SimplexReportDatabase:
         self.home_station_information_df["x"] = self.home_station_information_df[lon] * (k * np.pi / 180.0)
         self.home_station_information_df["y"] = \
             np.log(np.tan((90 + self.home_station_information_df[lat]) * np.pi / 360.0)) * k
+        self.reception_queries = None
 
     # noinspection SpellCheckingInspection
     @staticmethod
@@ -567,15 +1050,10 @@ class SimplexReportDatabase:
 
         return reception_df
 
-    def initiate_map_plot_object(self, scale, extent_factor, title_string):
-        """
-        set up a map plot give a list of participating hams and their locations
+    def map_extent(self, scale, extent_factor):
+        """web mercator extent of the maps, (x_min, x_max, y_min, y_max)
         there should already be columns x, y for mercator projection
         """
-        # set up the plot basics
-
-        # setup for and acquire the background tile
-
         # Establishing a zoom scale for the map. The scale variable will also determine proportions
         # for hexbins and bubble maps so that everything looks visually appealing.
         x = self.home_station_information_df['x']
@@ -588,6 +1066,18 @@ class SimplexReportDatabase:
         y_min = int(y.mean() - (scale * extent_factor))
         y_max = int(y.mean() + (scale * extent_factor))
 
+        return x_min, x_max, y_min, y_max
+
+    def initiate_map_plot_object(self, scale, extent_factor, title_string):
+        """
+        set up a map plot give a list of participating hams and their locations
+        there should already be columns x, y for mercator projection
+        """
+        # set up the plot basics
+
+        # setup for and acquire the background tile
+        x_min, x_max, y_min, y_max = self.map_extent(scale, extent_factor)
+
         # Defining the map tiles to use. I use OSM, but you can also use ESRI images or google street maps.
         tile_provider = get_provider(OSM)
 
@@ -621,26 +1111,70 @@ class SimplexReportDatabase:
 
         return p
 
+    def get_coverage_grid(self, transmitting_station, frequency, net_date=None,
+                          map_scale=500, map_extent=150, resolution=100, power=2):
+        """interpolated reception quality of a station over the map extent, cached
+
+        Quality is coded G/R 4, W/R 2, N/C 0 and interpolated by inverse distance weighting
+        from every receiving station.
+        :param str transmitting_station: station call sign
+        :param float frequency:
+        :param net_date: date of simplex net, a NetWindow, or None for all nets
+        :param float map_scale:
+        :param float map_extent:
+        :param int resolution: grid cells along each axis
+        :param float power: inverse distance weighting exponent
+        :return: (grid, (x_min, x_max, y_min, y_max)), grid rows run south to north
+        """
+        extent = self.map_extent(map_scale, map_extent)
+
+        reception = self.get_reception_arrays(transmitting_station, frequency, net_date)
+        x = reception['ReceivedX']
+        y = reception['ReceivedY']
+        values = reception['ReceivedQualityValue']
+
+        key = self.coverage_cache.key(transmitting_station, frequency, net_date)
+        fingerprint = data_fingerprint(x, y, values, extent, [resolution, power])
+
+        grid = self.coverage_cache.get(key, fingerprint)
+        if grid is None:
+            grid = idw_grid(x, y, values, extent[:2], extent[2:], resolution=resolution, power=power)
+            self.coverage_cache.put(key, fingerprint, grid)
+
+        return grid, extent
+
+    def add_coverage_layer(self, p, transmitting_station, frequency, net_date=None,
+                           map_scale=500, map_extent=150, alpha=0.4):
+        """draw the interpolated coverage of a station as an image just above the map tiles"""
+        grid, (x_min, x_max, y_min, y_max) = self.get_coverage_grid(transmitting_station, frequency, net_date,
+                                                                     map_scale=map_scale, map_extent=map_extent)
+
+        # red for N/C through green for G/R
+        color_mapper = LinearColorMapper(palette=list(reversed(RdYlGn9)), low=0, high=4, nan_color=(0, 0, 0, 0))
+        coverage_r = p.image(image=[grid], x=x_min, y=y_min, dw=x_max - x_min, dh=y_max - y_min,
+                             color_mapper=color_mapper, global_alpha=alpha, level='underlay')
+
+        return coverage_r
+
     def plot_station_reception(self,
                                transmitting_station,
                                frequency, net_date=None,
                                map_scale=500,
-                               map_extent=150):
+                               map_extent=150,
+                               coverage=False):
         """plot the reception of a specific ham on a specific frequency
         for all reports in the database
         :param str transmitting_station: station call sign
         :param float frequency:
-        :param str net_date: date of simplex net, mm/dd/yyyy, do not pad with zeros
+        :param net_date: date of simplex net, m/d/yyyy padded with zeros or not, or a NetWindow
         :param float map_scale:
         :param float map_extent:
+        :param bool coverage: True to add the interpolated coverage underlay
         :return object: bokeh plot object
         """
-        # TODO accept dates padded with zeros e.g. 01/07/2021
-
-        # get the reception data from the reports
-        reception_df = self.get_one_ham_reception_data(transmitting_station, frequency, net_date)
-        reception_df = self.add_reception_scaled_value(reception_df, map_scale)
-        reception_df = self.add_received_locations(reception_df)
+        # get the reception data from the reports, as arrays ready for the glyph source
+        reception = self.get_reception_arrays(transmitting_station, frequency, net_date)
+        reception['ReceivedQualityValue'] = reception['ReceivedQualityValue'] * map_scale
 
         # Create the base map and plot, do not add hover tool yet
         if net_date is None:
@@ -648,19 +1182,20 @@ class SimplexReportDatabase:
         else:
             title_string = f'where {transmitting_station} was heard on {frequency}, {net_date}'
 
-        if all([x == 'None' for x in reception_df['TransmittingStationPower'].to_list()]):
+        # power is nan for rows no report of the transmitting station filled in
+        transmit_power = reception['TransmittingStationPower']
+        if np.isnan(transmit_power).all():
             title_string_transmit_power = 'station may not have participated in this net, no power data found'
         else:
-            try:
-                title_string_transmit_power = 'using mean transmit power of {} watts'.format(
-                    reception_df['TransmittingStationPower'].mean())
-            except:
-                title_string_transmit_power = None
+            title_string_transmit_power = 'using mean transmit power of {} watts'.format(np.nanmean(transmit_power))
 
         p = self.initiate_map_plot_object(map_scale, map_extent, None)
         # p = self.initiate_map_plot_object(map_scale, map_extent, title_string)
+        if coverage:
+            self.add_coverage_layer(p, transmitting_station, frequency, net_date,
+                                    map_scale=map_scale, map_extent=map_extent)
         source_hamlist = ColumnDataSource(self.home_station_information_df)
-        source_reports = ColumnDataSource(reception_df)
+        source_reports = ColumnDataSource(reception)
 
         # Create the glyphs by hand first
 
@@ -710,8 +1245,211 @@ class SimplexReportDatabase:
 
         return p
 
-    def plot_all_stations_to_html(self, frequency, net_date=None, html_path="index.html"):
+    def get_quality_matrix(self, frequency, net_date=None):
+        """transmitter x receiver quality matrix over the stations in the Hams table
+
+        :param float frequency:
+        :param net_date: date of simplex net, a list of dates, a NetWindow, or None to average over all nets
+        :return: (matrix, list of call signs), see reciprocity.quality_matrix
+        """
+        command = "SELECT TransmittingStation, ReceivingStation, QSOQuality FROM RESPONSES WHERE FrequencyOfNet=?"
+        parameters = [float(frequency)]
+        condition, window_parameters = date_condition(net_date, frequency)
+        if condition is not None:
+            command = command + " AND " + condition
+            parameters.extend(window_parameters)
+
+        responses_df = pd.read_sql(command, self.con, params=parameters)
+        stations = self.home_station_information_df['Call'].to_list()
+
+        return reciprocity.quality_matrix(responses_df, stations), stations
+
+    def analyze_reciprocity(self, frequency, net_date=None):
+        """compare how well each pair of stations heard each other
+
+        :param float frequency:
+        :param str net_date: date of simplex net, None for all nets
+        :return: (pairs DataFrame, station balance DataFrame, summary dict), see the reciprocity module
+        """
+        matrix, stations = self.get_quality_matrix(frequency, net_date)
+        pairs_df = reciprocity.reciprocal_pairs(matrix, stations)
+
+        return pairs_df, reciprocity.station_balance(matrix, stations), reciprocity.summarize_reciprocity(pairs_df)
+
+    def plot_link_asymmetry(self, frequency, net_date=None, map_scale=500, map_extent=150):
+        """map of the reciprocal links, lines colored by how lopsided they are
+
+        :param float frequency:
+        :param str net_date: date of simplex net, None for all nets
+        :param float map_scale:
+        :param float map_extent:
+        :return object: bokeh plot object
+        """
+        pairs_df, balance_df, summary = self.analyze_reciprocity(frequency, net_date)
+
+        locations = self.home_station_information_df.set_index('Call')
+        pairs_df['xs'] = [[locations.at[a, 'x'], locations.at[b, 'x']]
+                          for a, b in zip(pairs_df['StationA'], pairs_df['StationB'])]
+        pairs_df['ys'] = [[locations.at[a, 'y'], locations.at[b, 'y']]
+                          for a, b in zip(pairs_df['StationA'], pairs_df['StationB'])]
+        pairs_df['color'] = np.where(pairs_df['Agree'], 'green',
+                                     np.where(pairs_df['Difference'].abs() >= 2, 'red', 'orange'))
+
+        p = self.initiate_map_plot_object(map_scale, map_extent, None)
+        links_r = p.multi_line(xs='xs', ys='ys', line_color='color', line_width=2, line_alpha=0.6,
+                               source=ColumnDataSource(pairs_df.drop(columns=['Agree'])))
+        p.add_tools(HoverTool(renderers=[links_r], tooltips=[('', '@StationA - @StationB'),
+                                                             ('B heard A', '@BHeardA'),
+                                                             ('A heard B', '@AHeardB')]))
+
+        hamlist_r = p.add_glyph(ColumnDataSource(self.home_station_information_df), Dot(x='x', y='y', size=10))
+        p.add_tools(HoverTool(renderers=[hamlist_r], tooltips=[('', '@Call')]))
+
+        when = 'all nets' if net_date is None else net_date
+        p.add_layout(Label(x=10, y=46, x_units='screen', y_units='screen',
+                           text=f'link reciprocity on {frequency}, {when}', render_mode='css',
+                           background_fill_color='white', background_fill_alpha=1.0))
+        p.add_layout(Label(x=10, y=30, x_units='screen', y_units='screen',
+                           text='lines: green agree, orange differ, red lopsided', render_mode='css',
+                           background_fill_color='white', background_fill_alpha=1.0))
+        p.add_layout(Label(x=10, y=12, x_units='screen', y_units='screen',
+                           text=f"{summary['pairs']} pairs, {summary['asymmetric']} lopsided", render_mode='css',
+                           text_font_size='8pt',
+                           background_fill_color='white', background_fill_alpha=1.0))
+
+        return p
+
+    def get_relay_graph(self, frequency, net_dates=None, min_quality=1.0):
+        """relay routing graph for a frequency over a set of nets, cached
+
+        :param float frequency:
+        :param net_dates: date of simplex net, a list of dates, a NetWindow, or None for all nets
+        :param float min_quality: mean quality below which a link is not used, see RelayGraph
+        :return: RelayGraph
+        """
+        if isinstance(net_dates, str):
+            net_dates = [net_dates]
+        if net_dates is None or isinstance(net_dates, NetWindow):
+            dates_key = net_dates
+        else:
+            dates_key = tuple(sorted(net_day(d) or d for d in net_dates))
+        key = (float(frequency), dates_key, min_quality)
+
+        if key not in self.relay_graph_cache:
+            matrix, stations = self.get_quality_matrix(frequency, net_dates)
+            self.relay_graph_cache[key] = RelayGraph(matrix, stations, min_quality=min_quality)
+
+        return self.relay_graph_cache[key]
+
+    def add_route_layer(self, p, route, color='purple'):
+        """draw a relay route, a list of call signs, on a map figure"""
+        locations = self.home_station_information_df.set_index('Call')
+        source = ColumnDataSource({'x': [locations.at[call, 'x'] for call in route],
+                                   'y': [locations.at[call, 'y'] for call in route],
+                                   'Call': route,
+                                   'hop': [str(i) for i in range(len(route))]})
+
+        route_r = p.line(x='x', y='y', source=source, line_color=color, line_width=3, line_alpha=0.8)
+        p.circle(x='x', y='y', source=source, size=8, color=color)
+        p.text(x='x', y='y', text='hop', source=source, x_offset=6, y_offset=-6, text_font_size='10pt',
+               text_color=color)
+
+        return route_r
+
+    def plot_relay_route(self, origin, destination, frequency, net_dates=None,
+                         map_scale=500, map_extent=150):
+        """map the best relay route between two stations
+
+        :param str origin: call sign the message starts from
+        :param str destination: call sign the message goes to
+        :param float frequency:
+        :param net_dates: date of simplex net, a list of dates, or None for all nets
+        :param float map_scale:
+        :param float map_extent:
+        :return object: bokeh plot object
+        """
+        route = self.get_relay_graph(frequency, net_dates).route(origin, destination)
+
+        p = self.initiate_map_plot_object(map_scale, map_extent, None)
+        hamlist_r = p.add_glyph(ColumnDataSource(self.home_station_information_df), Dot(x='x', y='y', size=10))
+        p.add_tools(HoverTool(renderers=[hamlist_r], tooltips=[('', '@Call')]))
+
+        if len(route) > 0:
+            self.add_route_layer(p, route)
+            text = f"{origin} to {destination} on {frequency}: {len(route) - 1} hops via {' '.join(route[1:-1])}"
+        else:
+            text = f'no relay route from {origin} to {destination} on {frequency}'
+
+        p.add_layout(Label(x=10, y=12, x_units='screen', y_units='screen', text=text, render_mode='css',
+                           background_fill_color='white', background_fill_alpha=1.0))
+
+        return p
+
+    def export_station_thumbnails(self, frequency, net_date=None, out_dir='thumbnails', size=(300, 300),
+                                  image_format='png', map_scale=500, map_extent=150, basemap_dir=None):
+        """draw a reception image for every station of a net without a browser
+
+        :param float frequency:
+        :param net_date: date of simplex net, a NetWindow, or None for all nets
+        :param str out_dir: directory for the images
+        :param tuple size: (width, height) in pixels
+        :param str image_format: 'png' or 'svg'
+        :param float map_scale:
+        :param float map_extent:
+        :param str basemap_dir: where the basemap images are kept, default out_dir
+        :return: dict of call sign -> image file name
+        """
+        frequency = float(frequency)
+        os.makedirs(out_dir, exist_ok=True)
+        extent = self.map_extent(map_scale, map_extent)
+        basemap = thumbnails.load_basemap(extent, size, basemap_dir or out_dir)
+        basemap_file_name = thumbnails.basemap_file_name(extent, size, basemap_dir or out_dir)
+        basemap_href = os.path.relpath(basemap_file_name, out_dir) if os.path.exists(basemap_file_name) else None
+
+        # one query for the whole net, the images are cut from it
+        command = "SELECT TransmittingStation, ReportingStation, QSOQuality FROM RESPONSES WHERE FrequencyOfNet=?"
+        parameters = [float(frequency)]
+        condition, window_parameters = date_condition(net_date, frequency)
+        if condition is not None:
+            command = command + " AND " + condition
+            parameters.extend(window_parameters)
+        responses_df = pd.read_sql(command, self.con, params=parameters)
+        responses_df = self.add_reception_scaled_value(responses_df, map_scale)
+
+        locations = self.home_station_information_df.set_index('Call')
+        responses_df['ReceivedX'] = responses_df['ReportingStation'].map(locations['x'])
+        responses_df['ReceivedY'] = responses_df['ReportingStation'].map(locations['y'])
+        responses_df = responses_df.dropna(subset=['ReceivedX', 'ReceivedY', 'ReceivedQualityValue'])
+
+        stations = list(zip(locations['x'], locations['y']))
+        by_transmitter = dict(list(responses_df.groupby('TransmittingStation')))
+        when = 'all nets' if net_date is None else str(normalize_net_date(net_date))
+
+        files = {}
+        for station in locations.index:
+            df = by_transmitter.get(station, responses_df.iloc[:0])
+            reception = list(zip(df['ReceivedX'], df['ReceivedY'], df['ReceivedQualityValue']))
+            transmitter = (locations.at[station, 'x'], locations.at[station, 'y'])
+            title = f'{station} on {frequency}, {when}'
+
+            file_name = os.path.join(out_dir, f'{station}_{frequency:.3f}_{when}.{image_format}'.replace('/', '-')
+                                     .replace(' ', '_').replace(',', ''))
+            if image_format == 'svg':
+                with open(file_name, 'w') as fp:
+                    fp.write(thumbnails.render_svg(basemap_href, extent, size, stations, reception, transmitter,
+                                                   title))
+            else:
+                thumbnails.render_png(basemap, extent, stations, reception, transmitter, title).save(file_name)
+            files[station] = file_name
+
+        print(f'drew {len(files)} station images for {frequency}, {when}')
+
+        return files
+
+    def plot_all_stations_to_html(self, frequency, net_date=None, html_path="index.html", coverage=False,
+                                  show_plots=True):
         """make reception plots for all the stations in the Hams table
+        :param bool show_plots: False to only write the page, e.g. on a server without a browser
         """
         plot_list = []
 
@@ -721,7 +1459,7 @@ class SimplexReportDatabase:
         for station in self.home_station_information_df['Call']:
             # TODO here use get_one_ham_reception_data and filter for any W/R or G/R
             # but how do we know the person did nor did not participate in the net?
-            one_plot = self.plot_station_reception(station, frequency, net_date=net_date)
+            one_plot = self.plot_station_reception(station, frequency, net_date=net_date, coverage=coverage)
             plot_list.append(one_plot)
 
         output_file(html_path)
@@ -730,5 +1468,61 @@ class SimplexReportDatabase:
 
         g = gridplot(plot_list, ncols=2, plot_width=400, plot_height=600)
 
-        show(g)
+        if show_plots:
+            show(g)
+        else:
+            save(g)
+
+    def export_site_bundles(self, frequencies, dates=None, out_dir='site', only=None):
+        """write the data-only web site, compact JSON bundles plus one shared viewer page
+
+        :param list frequencies: net frequencies to export
+        :param list dates: net dates to export, each as its own bundle, padded with zeros or not,
+            or None for every date in the database. A bundle aggregating all nets is always written
+            for each frequency.
+        :param str out_dir: directory for the site files
+        :param set only: (frequency, net date) bundles to rebuild, net date None for the aggregate,
+            None to rebuild them all. The others are left as they are on disk.
+        :return: list of file names written, i.e. the files that need uploading
+        :raises ValueError: if one of the dates given is not a date
+        """
+        if dates is not None:
+            bad_dates = [net_date for net_date in dates if net_day(net_date) is None]
+            if len(bad_dates) > 0:
+                raise ValueError('not net dates: ' + ', '.join(repr(net_date) for net_date in bad_dates))
+
+        stations = site_export.build_stations_bundle(self.home_station_information_df)
+        files = {'stations.json': site_export.dumps(stations)}
+        order = []
+
+        for frequency in frequencies:
+            # one query per frequency, every bundle for it is cut from this frame
+            responses_df = pd.read_sql("SELECT DateOfNet, TransmittingStation, TransmittingStationPower, " +
+                                       "ReceivingStation, QSOQuality FROM RESPONSES WHERE FrequencyOfNet=?",
+                                       self.con, params=[float(frequency)])
+            if dates is None:
+                # rows stored before dates were checked on ingest may hold text that is not a date
+                net_dates = [net_date for net_date in self.list_net_dates(frequency) if net_day(net_date) is not None]
+            else:
+                net_dates = [normalize_net_date(net_date) for net_date in dates]
+
+            for net_date in [None] + list(net_dates):
+                if net_date is None:
+                    df = responses_df
+                    label = f'{frequency} MHz, all nets'
+                else:
+                    df = responses_df[responses_df['DateOfNet'] == net_date]
+                    label = f'{frequency} MHz, {net_date}'
+
+                name = site_export.bundle_file_name(frequency, net_date)
+                order.append((name, label))
+                if only is not None and (float(frequency), net_date) not in only:
+                    continue
+
+                files[name] = site_export.dumps(
+                    site_export.build_reception_bundle(df, stations['call'], frequency, net_date))
+
+        changed = site_export.write_site(out_dir, files, order)
+        print(f'{len(changed)} of {len(order) + 3} site files changed')
 
+        return changed
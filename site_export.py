@@ -0,0 +1,259 @@
+"""site export module
+
+    A data-only version of the reception web site.
+
+    Instead of one large Bokeh page per (frequency, date), each holding the
+    whole station table once per figure, the export writes
+
+        stations.json               the station table, once
+        reception_<freq>_<date>.json  one compact bundle per (frequency, date)
+        manifest.json               the list of bundles with content hashes
+        viewer.html                 a static viewer that fetches only the bundle it shows
+
+    Files are rewritten only when their content changes, and the list of
+    changed files is returned so only those need to be uploaded.
+
+"""
+import os
+import json
+import hashlib
+import ftplib
+
+import numpy as np
+import pandas as pd
+
+from net_dates import net_day
+from reception_quality import QUALITY_CODES
+
+
+def bundle_file_name(frequency, net_date=None):
+    """file name of the bundle for a frequency and a net date, None for all nets
+
+    :raises ValueError: if net_date is not a date
+    """
+    if net_date is None:
+        label = 'all'
+    else:
+        day = net_day(net_date)
+        if day is None:
+            raise ValueError(f'net date {net_date!r} is not a date')
+        label = day.replace('-', '')
+
+    return 'reception_%d_%s.json' % (round(float(frequency) * 1000), label)
+
+
+def write_if_changed(path, text):
+    """write a file unless it already holds this text, True if it was written"""
+    if os.path.exists(path):
+        with open(path, 'r') as fp:
+            if fp.read() == text:
+                return False
+
+    with open(path, 'w') as fp:
+        fp.write(text)
+
+    return True
+
+
+def dumps(data):
+    return json.dumps(data, separators=(',', ':'), sort_keys=True)
+
+
+def build_stations_bundle(home_station_information_df):
+    """the station table as parallel columns, rounded to what a map needs"""
+    df = home_station_information_df
+    return {'call': df['Call'].to_list(),
+            'x': np.round(df['x'].to_numpy(dtype=float)).astype(int).tolist(),
+            'y': np.round(df['y'].to_numpy(dtype=float)).astype(int).tolist()}
+
+
+def build_reception_bundle(responses_df, calls, frequency, net_date=None):
+    """compact reception data for one (frequency, date), stations referred to by their index in stations.json
+
+    :param responses_df: RESPONSES rows with TransmittingStation, ReceivingStation, QSOQuality
+        and TransmittingStationPower
+    :param list calls: call signs in the order of stations.json
+    :param float frequency:
+    :param str net_date: None for all nets
+    :return: dict
+    """
+    station_number = {call: i for i, call in enumerate(calls)}
+
+    df = responses_df[responses_df['QSOQuality'].isin(QUALITY_CODES.keys())]
+    df = df[df['ReceivingStation'].isin(station_number.keys())]
+
+    transmitters = {}
+    for station, group in df.groupby('TransmittingStation', sort=True):
+        power = pd.to_numeric(group['TransmittingStationPower'], errors='coerce').mean()
+        transmitters[station] = {
+            'r': [station_number[call] for call in group['ReceivingStation']],
+            'q': [QUALITY_CODES[quality] for quality in group['QSOQuality']],
+            'p': None if np.isnan(power) else round(float(power), 1)}
+
+    return {'frequency': float(frequency), 'date': net_date, 'transmitters': transmitters}
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()[:12]
+
+
+def write_site(out_dir, files, order):
+    """write the bundles, manifest and viewer, skipping files whose content did not change
+
+    :param str out_dir:
+    :param dict files: file name -> JSON text, stations.json and the reception bundles that were rebuilt
+    :param list order: (file name, label) of the reception bundles in the order the viewer lists them
+    :return: list of the file names that were written
+    """
+    os.makedirs(out_dir, exist_ok=True)
+
+    # bundles not rebuilt this time keep their entry from the previous manifest
+    manifest_file_name = os.path.join(out_dir, 'manifest.json')
+    bundles = {}
+    if os.path.exists(manifest_file_name):
+        with open(manifest_file_name, 'r') as fp:
+            bundles = json.load(fp)['bundles']
+    bundles.update({name: content_hash(text) for name, text in files.items()})
+
+    manifest = {'bundles': bundles,
+                'order': [{'name': name, 'label': label} for name, label in order]}
+    files = dict(files)
+    files['manifest.json'] = dumps(manifest)
+
+    changed = [name for name, text in files.items() if write_if_changed(os.path.join(out_dir, name), text)]
+    if write_viewer(out_dir):
+        changed.append('viewer.html')
+
+    return changed
+
+
+def write_viewer(out_dir):
+    """write the shared static viewer page, True if it changed"""
+    return write_if_changed(os.path.join(out_dir, 'viewer.html'), VIEWER_HTML)
+
+
+def publish_files(file_names, out_dir, host, user, password, remote_dir='.'):
+    """upload the given files from out_dir to the web site over FTP
+
+    :param list file_names: names relative to out_dir, e.g. the changed files from an export
+    """
+    with ftplib.FTP(host, user, password) as ftp:
+        ftp.cwd(remote_dir)
+        for file_name in file_names:
+            with open(os.path.join(out_dir, file_name), 'rb') as fp:
+                ftp.storbinary(f'STOR {file_name}', fp)
+            print(f'uploaded {file_name}')
+
+
+VIEWER_HTML = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Reception Reports for ARES Simplex Net</title>
+<style>
+ body { font-family: sans-serif; }
+ svg { border: 1px solid #888; }
+</style>
+</head>
+<body>
+<h1>Reception Reports for ARES Simplex Net</h1>
+<p>
+ <select id="net"></select>
+ <select id="station"></select>
+</p>
+<p id="caption"></p>
+<svg id="map" width="600" height="600"></svg>
+<p>circles: G/R large, W/R small, N/C cross</p>
+<script>
+"use strict";
+const SIZE = 600, EXTENT = 75000, R = 6378137;
+const cache = {};
+let stations = null, manifest = null;
+
+function fetchJson(name) {
+  if (!(name in cache)) {
+    cache[name] = fetch(name + "?v=" + (manifest && manifest.bundles[name] || "")).then(r => r.json());
+  }
+  return cache[name];
+}
+
+function el(tag, attrs, parent) {
+  const e = document.createElementNS("http://www.w3.org/2000/svg", tag);
+  for (const k in attrs) e.setAttribute(k, attrs[k]);
+  parent.appendChild(e);
+  return e;
+}
+
+function draw(bundle, call) {
+  const svg = document.getElementById("map");
+  svg.innerHTML = "";
+  const n = stations.x.length;
+  const cx = stations.x.reduce((a, b) => a + b, 0) / n;
+  const cy = stations.y.reduce((a, b) => a + b, 0) / n;
+  const scale = SIZE / (2 * EXTENT);
+  const px = x => (x - cx + EXTENT) * scale;
+  const py = y => (cy + EXTENT - y) * scale;
+
+  // OpenStreetMap tiles behind the stations
+  const zoom = Math.floor(Math.log2(2 * Math.PI * R / (2 * EXTENT) * SIZE / 256));
+  const tile = 2 * Math.PI * R / Math.pow(2, zoom);
+  for (let i = Math.floor((cx - EXTENT + Math.PI * R) / tile); i * tile - Math.PI * R < cx + EXTENT; i++) {
+    for (let j = Math.floor((Math.PI * R - cy - EXTENT) / tile); Math.PI * R - j * tile > cy - EXTENT; j++) {
+      el("image", {href: `https://tile.openstreetmap.org/${zoom}/${i}/${j}.png`,
+                   x: px(i * tile - Math.PI * R), y: py(Math.PI * R - j * tile),
+                   width: tile * scale, height: tile * scale, opacity: 0.7}, svg);
+    }
+  }
+
+  for (let i = 0; i < n; i++) {
+    const dot = el("circle", {cx: px(stations.x[i]), cy: py(stations.y[i]), r: 3, fill: "black"}, svg);
+    el("title", {}, dot).textContent = stations.call[i];
+  }
+
+  const t = bundle.transmitters[call];
+  if (t) {
+    for (let k = 0; k < t.r.length; k++) {
+      const x = px(stations.x[t.r[k]]), y = py(stations.y[t.r[k]]);
+      if (t.q[k] > 0) {
+        el("circle", {cx: x, cy: y, r: 4 * t.q[k], fill: "none", stroke: "green", "stroke-width": 2}, svg);
+      } else {
+        el("path", {d: `M${x - 5},${y - 5}L${x + 5},${y + 5}M${x - 5},${y + 5}L${x + 5},${y - 5}`,
+                    stroke: "red", "stroke-width": 2}, svg);
+      }
+    }
+  }
+  const me = stations.call.indexOf(call);
+  if (me >= 0) {
+    el("text", {x: px(stations.x[me]) - 6, y: py(stations.y[me]) + 8, fill: "blue",
+                "font-size": 24}, svg).textContent = "*";
+  }
+
+  const when = bundle.date === null ? "all nets" : bundle.date;
+  let caption = `where ${call} was heard on ${bundle.frequency}, ${when}`;
+  if (!t || t.p === null) caption += " - station may not have participated in this net, no power data found";
+  else caption += ` - using mean transmit power of ${t.p} watts`;
+  document.getElementById("caption").textContent = caption;
+}
+
+function update() {
+  const name = document.getElementById("net").value;
+  const call = document.getElementById("station").value;
+  location.hash = name + "|" + call;
+  fetchJson(name).then(bundle => draw(bundle, call));
+}
+
+fetch("manifest.json", {cache: "no-cache"}).then(r => r.json())
+  .then(m => { manifest = m; return fetchJson("stations.json"); })
+  .then(s => {
+    stations = s;
+    const [wantNet, wantCall] = decodeURIComponent(location.hash.slice(1)).split("|");
+    const net = document.getElementById("net"), station = document.getElementById("station");
+    for (const b of manifest.order) net.add(new Option(b.label, b.name, false, b.name === wantNet));
+    for (const c of stations.call) station.add(new Option(c, c, false, c === wantCall));
+    net.onchange = station.onchange = update;
+    update();
+  });
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,225 @@
+"""snapshots module
+
+    Online snapshots of the report database with a retention policy.
+
+    Snapshots are taken with SQLite's backup API a batch of pages at a
+    time, so other connections can keep reading (and writing) while the
+    copy runs.  A snapshot is skipped, before anything is copied, when the
+    size and modification time of the database and of its write ahead log
+    are the ones recorded for the newest snapshot; the database file alone
+    would miss writes still in the log.  Each snapshot is a full copy, not
+    an increment.  Snapshots can be gzip compressed, and old ones are
+    thinned out by age so disk use stays bounded.
+
+    Snapshot files are named after the database with a timestamp appended,
+    e.g. 2mreports.db20210110153000123456 or 2mreports.db20210110153000123456.gz,
+    down to the microsecond so snapshots taken in the same second do not
+    replace each other.  Names with a timestamp to the second, the naming
+    the full copies made on recreate used before, can be listed and restored
+    as well, but the retention policy leaves them alone.
+
+"""
+import os
+import re
+import gzip
+import json
+import shutil
+import sqlite3
+import datetime
+import tempfile
+
+TIMESTAMP_FORMAT = '%Y%m%d%H%M%S%f'
+OLD_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+
+
+def snapshot_file_name(database_filename, snapshot_dir=None, when=None, compress=False):
+    if when is None:
+        when = datetime.datetime.today()
+    if snapshot_dir is None:
+        snapshot_dir = os.path.dirname(os.path.abspath(database_filename))
+
+    file_name = os.path.basename(database_filename) + when.strftime(TIMESTAMP_FORMAT)
+    if compress:
+        file_name = file_name + '.gz'
+
+    return os.path.join(snapshot_dir, file_name)
+
+
+def list_snapshots(database_filename, snapshot_dir=None, include_old=True):
+    """snapshots of a database, oldest first
+
+    :param bool include_old: False to leave out the copies named to the second, made before this module
+    :return: list of (datetime, file name)
+    """
+    if snapshot_dir is None:
+        snapshot_dir = os.path.dirname(os.path.abspath(database_filename))
+    if not os.path.isdir(snapshot_dir):
+        return []
+
+    timestamp = r'(\d{20}|\d{14})' if include_old else r'(\d{20})'
+    pattern = re.compile(re.escape(os.path.basename(database_filename)) + timestamp + r'(\.gz)?$')
+
+    snapshots = []
+    for file_name in os.listdir(snapshot_dir):
+        match = pattern.match(file_name)
+        if match is not None:
+            timestamp_format = TIMESTAMP_FORMAT if len(match.group(1)) == 20 else OLD_TIMESTAMP_FORMAT
+            when = datetime.datetime.strptime(match.group(1), timestamp_format)
+            snapshots.append((when, os.path.join(snapshot_dir, file_name)))
+
+    return sorted(snapshots)
+
+
+def state_file_name(database_filename, snapshot_dir=None):
+    """file recording the newest snapshot and the state of the database it was taken from"""
+    if snapshot_dir is None:
+        snapshot_dir = os.path.dirname(os.path.abspath(database_filename))
+
+    return os.path.join(snapshot_dir, os.path.basename(database_filename) + '.snapshot.json')
+
+
+def database_fingerprint(database_filename):
+    """size and modification time of a database file and of its write ahead log"""
+    fingerprint = []
+    for file_name in [database_filename, database_filename + '-wal']:
+        if os.path.exists(file_name):
+            stat = os.stat(file_name)
+            fingerprint.append([stat.st_size, stat.st_mtime_ns])
+        else:
+            fingerprint.append(None)
+
+    return fingerprint
+
+
+def copy_database(source_con, destination_con, pages=256):
+    """copy one open database into another with the backup API, pages at a time"""
+    source_con.backup(destination_con, pages=pages, sleep=0.005)
+
+
+def create_snapshot(database_filename, snapshot_dir=None, compress=False, pages=256, force=False):
+    """take an online snapshot of a database
+
+    :param str database_filename:
+    :param str snapshot_dir: where to keep the snapshots, default next to the database
+    :param bool compress: True to gzip the snapshot
+    :param int pages: pages copied per step, other connections get the database between steps
+    :param bool force: True to take a snapshot even if nothing changed since the newest one
+    :return: file name of the snapshot, the existing newest one if nothing changed, None if there is no database
+    """
+    if not os.path.exists(database_filename):
+        return None
+
+    if snapshot_dir is not None:
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+    existing = list_snapshots(database_filename, snapshot_dir, include_old=False)
+    # taken before the copy, a write landing while it runs shows up as a change next time
+    fingerprint = database_fingerprint(database_filename)
+    state_file = state_file_name(database_filename, snapshot_dir)
+    if not force and len(existing) > 0 and os.path.exists(state_file):
+        with open(state_file, 'r') as fp:
+            state = json.load(fp)
+        newest = existing[-1][1]
+        if state.get('snapshot') == os.path.basename(newest) and state.get('fingerprint') == fingerprint:
+            return newest
+
+    when = datetime.datetime.today()
+    file_name = snapshot_file_name(database_filename, snapshot_dir, when)
+    while any(os.path.exists(name) for name in [file_name, file_name + '.gz']):
+        # the clock did not move on since the last snapshot
+        when = when + datetime.timedelta(microseconds=1)
+        file_name = snapshot_file_name(database_filename, snapshot_dir, when)
+
+    # write to a temporary name first so a half written snapshot is never mistaken for a good one
+    fd, work_file_name = tempfile.mkstemp(dir=os.path.dirname(file_name), suffix='.tmp')
+    os.close(fd)
+
+    source_con = sqlite3.connect(database_filename)
+    destination_con = sqlite3.connect(work_file_name)
+    try:
+        copy_database(source_con, destination_con, pages=pages)
+    finally:
+        destination_con.close()
+        source_con.close()
+
+    if compress:
+        with open(work_file_name, 'rb') as fp_in, gzip.open(file_name + '.gz', 'wb', compresslevel=6) as fp_out:
+            shutil.copyfileobj(fp_in, fp_out, 1024 * 1024)
+        os.remove(work_file_name)
+        file_name = file_name + '.gz'
+    else:
+        os.replace(work_file_name, file_name)
+
+    with open(state_file, 'w') as fp:
+        json.dump({'snapshot': os.path.basename(file_name), 'fingerprint': fingerprint}, fp)
+
+    return file_name
+
+
+def snapshots_to_keep(snapshots, keep_last=5, keep_daily=7, keep_monthly=12):
+    """which snapshots a retention policy keeps
+
+    The newest keep_last snapshots are kept, plus the newest snapshot of each of the
+    last keep_daily days and of each of the last keep_monthly months that have one.
+
+    :param list snapshots: (datetime, file name), oldest first
+    :return: set of file names to keep
+    """
+    newest_first = list(reversed(snapshots))
+    keep = set(file_name for when, file_name in newest_first[:keep_last])
+
+    for period, count in [('%Y%m%d', keep_daily), ('%Y%m', keep_monthly)]:
+        seen = []
+        for when, file_name in newest_first:
+            key = when.strftime(period)
+            if key not in seen:
+                if len(seen) >= count:
+                    break
+                seen.append(key)
+                keep.add(file_name)
+
+    return keep
+
+
+def apply_retention(database_filename, snapshot_dir=None, keep_last=5, keep_daily=7, keep_monthly=12):
+    """delete the snapshots the retention policy does not keep
+
+    Only snapshots taken by create_snapshot are considered, older copies named to the second are kept.
+    :return: list of deleted file names
+    """
+    snapshots = list_snapshots(database_filename, snapshot_dir, include_old=False)
+    keep = snapshots_to_keep(snapshots, keep_last, keep_daily, keep_monthly)
+
+    removed = []
+    for when, file_name in snapshots:
+        if file_name not in keep:
+            os.remove(file_name)
+            removed.append(file_name)
+
+    return removed
+
+
+def restore_snapshot(snapshot_filename, database_filename, pages=-1):
+    """replace the contents of a database with a snapshot, in one call
+
+    The restore goes through the backup API, so connections already open on the
+    database see the restored contents rather than a deleted file.
+    """
+    if snapshot_filename.endswith('.gz'):
+        fd, work_file_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(database_filename)),
+                                              suffix='.tmp')
+        os.close(fd)
+        with gzip.open(snapshot_filename, 'rb') as fp_in, open(work_file_name, 'wb') as fp_out:
+            shutil.copyfileobj(fp_in, fp_out, 1024 * 1024)
+    else:
+        work_file_name = None
+
+    source_con = sqlite3.connect(work_file_name or snapshot_filename)
+    destination_con = sqlite3.connect(database_filename)
+    try:
+        copy_database(source_con, destination_con, pages=pages)
+    finally:
+        destination_con.close()
+        source_con.close()
+        if work_file_name is not None:
+            os.remove(work_file_name)
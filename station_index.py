@@ -0,0 +1,288 @@
+"""station index module
+
+    Spatial lookups over the station locations in the Hams table.
+
+    The stations are bucketed into a regular latitude/longitude grid
+    (much like a coarse geohash) so radius, bounding box and nearest
+    station queries only look at the cells that can contain an answer.
+    Nearest station searches go out from the point's cell ring by ring and
+    stop once no station outside the rings searched can be closer than the
+    k found.  Location validation is done in bulk with NumPy for a whole
+    batch of reports instead of one trig call per row.
+
+"""
+import difflib
+
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS = 6372800  # meters, the same radius used by SimplexReportDatabase.haversine
+
+
+def haversine_array(lat1, lon1, lat2, lon2):
+    """great circle distance in meters, broadcast over NumPy arrays
+
+    :param lat1: latitude(s) in decimal degrees
+    :param lon1: longitude(s) in decimal degrees
+    :param lat2: latitude(s) in decimal degrees
+    :param lon2: longitude(s) in decimal degrees
+    :return: array of distances in meters, nan where any input is nan
+    """
+    phi1 = np.radians(np.asarray(lat1, dtype=float))
+    phi2 = np.radians(np.asarray(lat2, dtype=float))
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2, dtype=float) - np.asarray(lon1, dtype=float))
+
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+class StationIndex:
+    """
+    A grid index over call signs and their base station locations.
+    """
+
+    def __init__(self, calls, latitudes, longitudes, cell_size=0.25):
+        """
+        :param calls: sequence of call signs
+        :param latitudes: sequence of decimal latitudes
+        :param longitudes: sequence of decimal longitudes
+        :param float cell_size: grid cell size in degrees
+        """
+        self.calls = np.asarray(calls, dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.cell_size = cell_size
+
+        # for a call listed more than once the last entry wins, as with an UPDATE of the Hams table
+        self.call_to_row = {call: i for i, call in enumerate(self.calls)}
+
+        self.cells = {}
+        rows = np.arange(len(self.calls))
+        keys = zip(*self._cell_of(self.latitudes, self.longitudes))
+        for key, row in zip(keys, rows):
+            self.cells.setdefault(key, []).append(row)
+        self.cells = {key: np.array(value) for key, value in self.cells.items()}
+        # the occupied cells as arrays, for ordering them by ring around a point
+        self.cell_keys = np.array(list(self.cells.keys()), dtype=int).reshape(-1, 2)
+        self.cell_rows = list(self.cells.values())
+
+    @classmethod
+    def from_dataframe(cls, df, cell_size=0.25):
+        """build the index from a frame with Call, Latitude and Longitude columns, e.g. the Hams table"""
+        return cls(df['Call'].to_list(), df['Latitude'].to_numpy(dtype=float),
+                   df['Longitude'].to_numpy(dtype=float), cell_size=cell_size)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def _cell_of(self, latitude, longitude):
+        return (np.floor(np.asarray(latitude, dtype=float) / self.cell_size).astype(int),
+                np.floor(np.asarray(longitude, dtype=float) / self.cell_size).astype(int))
+
+    def _rows_in_cells(self, lat_min, lat_max, lon_min, lon_max):
+        """candidate rows from every grid cell overlapping a bounding box"""
+        i_min, j_min = self._cell_of(lat_min, lon_min)
+        i_max, j_max = self._cell_of(lat_max, lon_max)
+
+        rows = [self.cells[(i, j)]
+                for i in range(int(i_min), int(i_max) + 1)
+                for j in range(int(j_min), int(j_max) + 1)
+                if (i, j) in self.cells]
+
+        if len(rows) == 0:
+            return np.array([], dtype=int)
+
+        return np.concatenate(rows)
+
+    def _frame(self, rows, distances=None):
+        df = pd.DataFrame({'Call': self.calls[rows],
+                           'Latitude': self.latitudes[rows],
+                           'Longitude': self.longitudes[rows]})
+        if distances is not None:
+            df['Distance'] = distances
+            df = df.sort_values('Distance', kind='stable').reset_index(drop=True)
+
+        return df
+
+    def location_of(self, calls):
+        """base station latitudes and longitudes for a sequence of calls, nan for unknown calls"""
+        rows = np.array([self.call_to_row.get(call, -1) for call in calls], dtype=int)
+        known = rows >= 0
+
+        lats = np.full(len(rows), np.nan)
+        lons = np.full(len(rows), np.nan)
+        lats[known] = self.latitudes[rows[known]]
+        lons[known] = self.longitudes[rows[known]]
+
+        return lats, lons
+
+    def nearest(self, latitude, longitude, k=1):
+        """nearest station(s) to one or many points
+
+        :param latitude: a latitude or an array of latitudes
+        :param longitude: a longitude or an array of longitudes
+        :param int k: how many stations to return per point
+        :return: (calls, distances) arrays shaped (n_points, k), distances in meters
+        """
+        lats = np.atleast_1d(np.asarray(latitude, dtype=float))
+        lons = np.atleast_1d(np.asarray(longitude, dtype=float))
+
+        if len(self.calls) == 0:
+            return np.full((len(lats), 1), None, dtype=object), np.full((len(lats), 1), np.nan)
+
+        k = min(k, len(self.calls))
+
+        nearest_calls = np.full((len(lats), k), None, dtype=object)
+        nearest_distances = np.full((len(lats), k), np.nan)
+        for n, (lat, lon) in enumerate(zip(lats, lons)):
+            # points without a location have no nearest station
+            if np.isnan(lat) or np.isnan(lon):
+                continue
+            rows, distances = self._nearest_rows(lat, lon, k)
+            nearest_calls[n] = np.where(np.isnan(distances), None, self.calls[rows])
+            nearest_distances[n] = distances
+
+        return nearest_calls, nearest_distances
+
+    def _nearest_rows(self, latitude, longitude, k):
+        """rows and distances of the k stations nearest one point, searching the grid ring by ring"""
+        i, j = (int(key) for key in self._cell_of(latitude, longitude))
+        # longitudes wrap around at the date line
+        columns = int(np.ceil(360 / self.cell_size))
+        column_steps = np.abs(self.cell_keys[:, 1] - j) % columns
+        rings = np.maximum(np.abs(self.cell_keys[:, 0] - i), np.minimum(column_steps, columns - column_steps))
+        order = np.argsort(rings, kind='stable')
+        last_ring = rings[order[-1]]
+
+        rows = np.array([], dtype=int)
+        distances = np.array([])
+        start = 0
+        while start < len(order):
+            ring = rings[order[start]]
+            end = start + int(np.searchsorted(rings[order[start:]], ring, side='right'))
+            ring_rows = np.concatenate([self.cell_rows[c] for c in order[start:end]])
+            start = end
+
+            rows = np.concatenate([rows, ring_rows])
+            distances = np.concatenate([distances, haversine_array(latitude, longitude, self.latitudes[ring_rows],
+                                                                   self.longitudes[ring_rows])])
+            best = np.lexsort((rows, distances))[:k]
+            rows, distances = rows[best], distances[best]
+
+            if len(rows) == k and (ring == last_ring or
+                                   distances[-1] <= self._ring_clearance(latitude, longitude, i, j, ring, columns)):
+                break
+
+        return rows, distances
+
+    def _ring_clearance(self, latitude, longitude, i, j, ring, columns):
+        """meters from a point in cell (i, j) to the nearest place outside the cells within ring of it"""
+        lat_gap = min(latitude - (i - ring) * self.cell_size, (i + ring + 1) * self.cell_size - latitude)
+        lon_gap = min(longitude - (j - ring) * self.cell_size, (j + ring + 1) * self.cell_size - longitude)
+
+        # along a meridian the distance is the latitude difference, across meridians at least the distance
+        # to the great circle through the nearer one
+        lat_clearance = EARTH_RADIUS * np.radians(lat_gap)
+        lon_clearance = EARTH_RADIUS * np.arcsin(np.cos(np.radians(latitude)) * np.sin(np.radians(min(lon_gap, 90))))
+        if 2 * ring + 1 >= columns:
+            # the rings go all the way round
+            lon_clearance = np.inf
+
+        return min(lat_clearance, lon_clearance)
+
+    def within_radius(self, latitude, longitude, radius):
+        """stations within a radius of a point, nearest first
+
+        :param float latitude:
+        :param float longitude:
+        :param float radius: meters
+        :return: DataFrame of Call, Latitude, Longitude, Distance
+        """
+        dlat = np.degrees(radius / EARTH_RADIUS)
+        # widen the longitude span toward the poles, capped so the cell loop stays bounded
+        dlon = dlat / max(np.cos(np.radians(latitude)), 0.01)
+
+        rows = self._rows_in_cells(latitude - dlat, latitude + dlat,
+                                   longitude - min(dlon, 180), longitude + min(dlon, 180))
+        distances = haversine_array(latitude, longitude, self.latitudes[rows], self.longitudes[rows])
+        inside = distances <= radius
+
+        return self._frame(rows[inside], distances[inside])
+
+    def in_bounding_box(self, lat_min, lat_max, lon_min, lon_max):
+        """stations inside a latitude/longitude bounding box"""
+        rows = self._rows_in_cells(lat_min, lat_max, lon_min, lon_max)
+        inside = ((self.latitudes[rows] >= lat_min) & (self.latitudes[rows] <= lat_max) &
+                  (self.longitudes[rows] >= lon_min) & (self.longitudes[rows] <= lon_max))
+
+        return self._frame(np.sort(rows[inside]))
+
+    def suggest_call(self, call, latitude=None, longitude=None):
+        """the station a misspelled or unknown call most likely belongs to
+
+        Close spellings are preferred, otherwise the station nearest the reported location.
+        """
+        matches = difflib.get_close_matches(call, self.calls.tolist(), n=1, cutoff=0.6)
+        if len(matches) > 0:
+            return matches[0]
+
+        if latitude is not None and longitude is not None and not np.isnan(latitude) and not np.isnan(longitude):
+            calls, _ = self.nearest(latitude, longitude)
+            return calls[0, 0]
+
+        return None
+
+    def validate_locations(self, calls, latitudes, longitudes,
+                           snap_distance=1000, implausible_distance=500000):
+        """check reported locations against the base stations, all reports at once
+
+        Status of each report:
+            base         no location reported, the base station location is used
+            snapped      reported within snap_distance of the base station, snapped to it
+            reported     reported away from the base station, e.g. a mobile or portable operator
+            implausible  reported further than implausible_distance from every station,
+                         most likely a sign or typing error, the base station location is used
+            unknown      call is not in the Hams table, see SuggestedCall
+
+        :param calls: sequence of reporting call signs
+        :param latitudes: sequence of reported latitudes, anything not numeric counts as missing
+        :param longitudes: sequence of reported longitudes
+        :param float snap_distance: meters
+        :param float implausible_distance: meters
+        :return: DataFrame with one row per report
+        """
+        calls = list(calls)
+        reported_lats = pd.to_numeric(pd.Series(list(latitudes), dtype=object), errors='coerce').to_numpy(dtype=float)
+        reported_lons = pd.to_numeric(pd.Series(list(longitudes), dtype=object), errors='coerce').to_numpy(dtype=float)
+        base_lats, base_lons = self.location_of(calls)
+
+        known = ~np.isnan(base_lats)
+        has_location = ~np.isnan(reported_lats) & ~np.isnan(reported_lons)
+        distance_to_base = haversine_array(reported_lats, reported_lons, base_lats, base_lons)
+        nearest_calls, nearest_distances = self.nearest(reported_lats, reported_lons)
+
+        status = np.full(len(calls), 'reported', dtype=object)
+        status[known & ~has_location] = 'base'
+        status[known & has_location & (distance_to_base <= snap_distance)] = 'snapped'
+        status[known & has_location & (nearest_distances[:, 0] > implausible_distance)] = 'implausible'
+        status[~known] = 'unknown'
+
+        use_base = np.isin(status, ['base', 'snapped', 'implausible'])
+        lats = np.where(use_base, base_lats, reported_lats)
+        lons = np.where(use_base, base_lons, reported_lons)
+
+        suggestions = [self.suggest_call(call, lat, lon) if not is_known else None
+                       for call, lat, lon, is_known in zip(calls, reported_lats, reported_lons, known)]
+
+        return pd.DataFrame({'Call': calls,
+                             'Status': status,
+                             'Latitude': lats,
+                             'Longitude': lons,
+                             'ReportedLatitude': reported_lats,
+                             'ReportedLongitude': reported_lons,
+                             'DistanceToBase': distance_to_base,
+                             'NearestCall': nearest_calls[:, 0],
+                             'NearestDistance': nearest_distances[:, 0],
+                             'SuggestedCall': suggestions})
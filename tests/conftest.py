@@ -0,0 +1,120 @@
+"""shared fixtures: the modules are imported from the repository root, a local stand-in for the Sheets API,
+a small report database"""
+import os
+import sys
+import json
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class SheetServer:
+    """
+    A local http server answering from scripted responses, per path.
+    """
+
+    def __init__(self):
+        # path -> list of (status, headers, body), the last one is repeated
+        self.responses = {}
+        # (method, path, request headers) of every request received
+        self.requests = []
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def answer(self, send_body):
+                server.requests.append((self.command, self.path, dict(self.headers)))
+                script = server.responses.get(self.path.split('?')[0], [(404, {}, b'')])
+                status, headers, body = script.pop(0) if len(script) > 1 else script[0]
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                if send_body and status != 304:
+                    self.wfile.write(body)
+
+            def do_GET(self):
+                self.answer(True)
+
+            def do_HEAD(self):
+                self.answer(False)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.httpd.server_address[1]}{path}'
+
+    def respond(self, path, *responses):
+        """script the answers to a path, each (status, headers, body) with values given as a list or body bytes"""
+        self.responses[path] = [(status, headers, json.dumps({'values': body}).encode('utf-8')
+                                 if isinstance(body, list) else body) for status, headers, body in responses]
+
+    def count(self, path, method='GET'):
+        return sum(1 for command, request_path, headers in self.requests
+                   if command == method and request_path.split('?')[0] == path)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def sheet_server():
+    server = SheetServer()
+    yield server
+    server.close()
+
+
+CALLS = ['K1WCC', 'W1FX', 'N1AB', 'KB1XY']
+LOCATIONS = [(42.55, -70.9), (42.6, -71.0), (42.45, -70.95), (42.7, -71.1)]
+FORM_HEADER = ['Timestamp', 'Call sign', 'Date', 'Frequency', 'Power', 'Height', 'Latitude', 'Longitude',
+               'Comments'] + [f'[{call}]' for call in CALLS]
+
+
+def form_rows(dates=('11/5/2020', '11/19/2020'), frequency='146.58'):
+    """form responses, header first, every station reporting every other one on each date"""
+    qualities = ['G/R', 'W/R', 'N/C']
+    rows = [FORM_HEADER]
+    for net_date in dates:
+        for i, (call, (latitude, longitude)) in enumerate(zip(CALLS, LOCATIONS)):
+            rows.append([f'{net_date} 20:00:00', call, net_date, frequency, '50', '100', str(latitude),
+                         str(longitude), ''] +
+                        ['' if j == i else qualities[(i + j) % 3] for j in range(len(CALLS))])
+    return rows
+
+
+@pytest.fixture
+def station_file(tmp_path):
+    file_name = str(tmp_path / 'stations.txt')
+    with open(file_name, 'w') as fp:
+        fp.write('call,latitude,longitude\n\n')
+        for call, (latitude, longitude) in zip(CALLS, LOCATIONS):
+            fp.write(f'{call},{latitude},{longitude}\n')
+    return file_name
+
+
+@pytest.fixture
+def report_db(tmp_path, station_file):
+    """a report database holding form_rows()"""
+    from simplex_net import SimplexReportDatabase
+
+    db = SimplexReportDatabase(str(tmp_path / 'reports.db'), coverage_cache_dir=str(tmp_path / 'coverage'),
+                               snapshot_dir=str(tmp_path / 'snapshots'))
+    db.write_station_information(db.read_station_information_file(station_file))
+    db.read_all_base_station_information()
+    db.wgs84_to_web_mercator()
+    db.populate_database_with_reports(form_rows())
+    yield db
+    db.con.close()
+    db.con = None
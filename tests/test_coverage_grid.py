@@ -0,0 +1,28 @@
+"""CoverageCache keys and file names"""
+import numpy as np
+
+from coverage_grid import CoverageCache
+from net_dates import NetWindow
+
+
+def test_dates_that_read_alike_get_their_own_files(tmp_path):
+    cache = CoverageCache(str(tmp_path))
+    november = cache.key('K1WCC', 146.58, ['11/7/2021'])
+    january = cache.key('K1WCC', 146.58, ['1/17/2021'])
+    assert cache._file_name(november) != cache._file_name(january)
+
+    cache.put(november, 'n', np.zeros((2, 2)))
+    cache.put(january, 'j', np.ones((2, 2)))
+
+    fresh = CoverageCache(str(tmp_path))
+    assert fresh.get(november, 'n').sum() == 0
+    assert fresh.get(january, 'j').sum() == 4
+
+
+def test_file_names_of_all_nets_and_windows(tmp_path):
+    cache = CoverageCache(str(tmp_path))
+    names = set(cache._file_name(cache.key('K1WCC', '146.58', dates)) for dates in
+                [None, ['1/7/2021', '11/5/2020'], NetWindow('1/7/2021', '2/4/2021'), NetWindow(last=3)])
+
+    assert len(names) == 4
+    assert all(name.endswith('.npz') and 'K1WCC_146.580_' in name for name in names)
@@ -0,0 +1,48 @@
+"""FederatedReportDatabase merging shards"""
+import pytest
+
+from federation import FederatedReportDatabase
+from conftest import CALLS, form_rows
+
+
+@pytest.fixture
+def federation_files(tmp_path, station_file):
+    return (str(tmp_path / 'registry.db'), {'clubA': str(tmp_path / 'a.db'), 'clubB': str(tmp_path / 'b.db')},
+            station_file)
+
+
+def open_federation(federation_files):
+    registry_filename, shards, station_file = federation_files
+    return FederatedReportDatabase(registry_filename, shards, station_locations_filename=station_file)
+
+
+def test_a_net_split_over_two_sources(federation_files):
+    fed = open_federation(federation_files)
+    rows = form_rows(dates=('11/5/2020',))
+    # half the stations report through each source, each source only knows its own reporters' power
+    fed.ingest({'clubA': [rows[0]] + rows[1:3], 'clubB': [rows[0]] + rows[3:]}, parallel=False)
+
+    statistics = fed.get_station_statistics(frequency=146.58)
+    assert sorted(statistics['TransmittingStation']) == sorted(CALLS)
+    assert statistics['TransmitPower'].notna().all()
+    assert set(fed.get_one_ham_reception_data(CALLS[0], 146.58)['TransmittingStationPower']) == {50.0}
+
+
+def test_only_changed_nets_are_merged_again(federation_files, monkeypatch):
+    fed = open_federation(federation_files)
+    fed.ingest({'clubA': form_rows(dates=('11/5/2020',)), 'clubB': form_rows(dates=('11/19/2020',))},
+               parallel=False)
+    fed.con.close()
+
+    merged = []
+    original = FederatedReportDatabase.update_net_statistics
+    monkeypatch.setattr(FederatedReportDatabase, 'update_net_statistics',
+                        lambda self, nets=None: merged.append(nets) or original(self, nets))
+
+    fed = open_federation(federation_files)
+    assert merged == []
+
+    fed.ingest({'clubB': form_rows(dates=('11/19/2020', '12/3/2020'))}, parallel=False)
+    assert merged == [{(146.58, '12/3/2020')}]
+    assert fed.list_net_dates(146.58) == ['11/5/2020', '11/19/2020', '12/3/2020']
+    assert len(fed.get_station_statistics(frequency=146.58)) == 3 * len(CALLS)
@@ -0,0 +1,203 @@
+"""FormWatcher polling, debounce and failures, with FileSource and HttpSource"""
+import csv
+import time
+import sqlite3
+
+import pytest
+
+from form_watcher import FormWatcher, FileSource, HttpSource
+from conftest import CALLS, form_rows
+
+HEADER = ['Timestamp', 'Call sign', 'Date', 'Frequency', '[K1WCC]']
+
+
+def row(call):
+    return ['11/5/2020 20:00:00', call, '11/5/2020', '146.58', 'G/R']
+
+
+class RecordingDatabase:
+    """
+    Stands in for SimplexReportDatabase, records what the watcher hands it.
+    """
+
+    def __init__(self):
+        self.ingested = []
+        self.regenerated = []
+
+    def append_new_reports(self, form_data):
+        self.ingested.append(form_data)
+        return set((report[1], float(report[3]), report[2]) for report in form_data[1:])
+
+    def regenerate_outputs(self, affected):
+        self.regenerated.append(affected)
+
+
+def write_form(file_name, calls):
+    with open(file_name, 'w', newline='') as fp:
+        csv.writer(fp).writerows([HEADER] + [row(call) for call in calls])
+
+
+@pytest.fixture
+def form_file(tmp_path):
+    return str(tmp_path / 'form.csv')
+
+
+def test_update_waits_for_the_debounce(form_file):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, FileSource(form_file), debounce=10, max_wait=100)
+
+    write_form(form_file, ['K1WCC'])
+    assert watcher.check_once(now=0) == set()
+    assert watcher.check_once(now=9) == set()
+    assert watcher.check_once(now=10) == {('K1WCC', 146.58, '11/5/2020')}
+    assert len(db.ingested) == 1
+    assert db.regenerated == [{('K1WCC', 146.58, '11/5/2020')}]
+
+    # nothing new, nothing fetched
+    assert watcher.check_once(now=30) == set()
+    assert len(db.ingested) == 1
+
+
+def test_a_new_submission_restarts_the_debounce(form_file):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, FileSource(form_file), debounce=10, max_wait=100)
+
+    write_form(form_file, ['K1WCC'])
+    watcher.check_once(now=0)
+    write_form(form_file, ['K1WCC', 'W1FX'])
+    assert watcher.check_once(now=5) == set()
+    assert watcher.check_once(now=14) == set()
+    assert len(watcher.check_once(now=15)) == 2
+    assert len(db.ingested) == 1
+
+
+def test_max_wait_updates_while_submissions_keep_coming(form_file):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, FileSource(form_file), debounce=10, max_wait=30)
+
+    calls = []
+    for now in range(0, 30, 5):
+        calls.append(f'W1X{now}')
+        write_form(form_file, calls)
+        assert watcher.check_once(now=now) == set()
+
+    calls.append('W1X30')
+    write_form(form_file, calls)
+    assert len(watcher.check_once(now=30)) == len(calls)
+    assert len(db.ingested) == 1
+
+
+def test_missing_file_is_no_change(form_file):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, FileSource(form_file), debounce=0)
+
+    assert watcher.check_once(now=0) == set()
+    assert db.ingested == []
+
+
+def test_http_source_retries_after_a_failed_fetch(sheet_server):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, HttpSource(sheet_server.url('/form'), timeout=5), debounce=0)
+
+    sheet_server.respond('/form', (200, {'ETag': '"v1"'}, b'<html>try again later</html>'))
+    assert watcher.check_once(now=0) == set()
+    assert watcher.ingested_revision is None
+    assert db.ingested == []
+
+    sheet_server.respond('/form', (200, {'ETag': '"v1"'}, [HEADER, row('K1WCC')]))
+    assert watcher.check_once(now=1) == {('K1WCC', 146.58, '11/5/2020')}
+
+    # the ETag has not moved, only HEAD requests from now on
+    assert watcher.check_once(now=2) == set()
+    assert sheet_server.count('/form') == 2
+    assert sheet_server.count('/form', 'HEAD') == 3
+
+
+def test_http_source_unreachable(sheet_server):
+    db = RecordingDatabase()
+    watcher = FormWatcher(db, HttpSource(sheet_server.url('/form'), timeout=5), debounce=0)
+
+    # no responses scripted, the server answers 404
+    assert watcher.check_once(now=0) == set()
+    assert db.ingested == []
+
+
+class FailingDatabase(RecordingDatabase):
+    """
+    Fails the first ingests, as a locked database would.
+    """
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def append_new_reports(self, form_data):
+        if self.failures > 0:
+            self.failures -= 1
+            raise sqlite3.OperationalError('database is locked')
+        return super().append_new_reports(form_data)
+
+
+def test_failed_ingest_is_tried_again(form_file):
+    db = FailingDatabase(failures=1)
+    watcher = FormWatcher(db, FileSource(form_file), debounce=0)
+    write_form(form_file, ['K1WCC'])
+
+    assert watcher.check_once(now=0) == set()
+    assert watcher.ingested_revision is None
+    assert watcher.failures == 1
+
+    assert watcher.check_once(now=1) == {('K1WCC', 146.58, '11/5/2020')}
+    assert watcher.failures == 0
+
+
+def test_failed_on_change_is_tried_again(form_file):
+    db = RecordingDatabase()
+    calls = []
+
+    def on_change(affected):
+        calls.append(affected)
+        if len(calls) == 1:
+            raise OSError('disk full')
+
+    watcher = FormWatcher(db, FileSource(form_file), on_change=on_change, debounce=0)
+    write_form(form_file, ['K1WCC'])
+
+    assert watcher.check_once(now=0) == {('K1WCC', 146.58, '11/5/2020')}
+    assert watcher.pending == {('K1WCC', 146.58, '11/5/2020')}
+
+    # nothing new in the form, the outputs are regenerated anyway
+    assert watcher.check_once(now=1) == set()
+    assert calls == [{('K1WCC', 146.58, '11/5/2020')}] * 2
+    assert watcher.pending == set()
+    assert len(db.ingested) == 1
+
+
+def test_run_backs_off_and_keeps_polling(form_file, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(time, 'sleep', sleeps.append)
+    db = FailingDatabase(failures=2)
+    watcher = FormWatcher(db, FileSource(form_file), poll_interval=10, debounce=0)
+    write_form(form_file, ['K1WCC'])
+
+    watcher.run(max_polls=4)
+
+    assert sleeps == [20, 40, 10]
+    assert len(db.ingested) == 1
+
+
+def test_file_source_into_a_report_database(report_db, form_file):
+    regenerated = []
+    watcher = FormWatcher(report_db, FileSource(form_file), on_change=regenerated.append, debounce=0)
+    with open(form_file, 'w', newline='') as fp:
+        csv.writer(fp).writerows(form_rows(dates=('11/5/2020', '11/19/2020', '12/3/2020')))
+
+    affected = watcher.check_once(now=0)
+
+    assert set(net_date for station, frequency, net_date in affected) == {'12/3/2020'}
+    assert regenerated == [affected]
+    assert report_db.list_net_dates(146.58) == ['11/5/2020', '11/19/2020', '12/3/2020']
+    statistics = report_db.get_station_statistics(frequency=146.58, net_date='12/3/2020')
+    assert set(statistics['TransmittingStation']) == set(CALLS)
+
+    assert watcher.check_once(now=1) == set()
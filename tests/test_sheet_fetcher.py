@@ -0,0 +1,92 @@
+"""AsyncSheetFetcher against a local stand-in for the Sheets API"""
+import asyncio
+
+import pytest
+
+from sheet_fetcher import AsyncSheetFetcher, FetchError
+
+VALUES = [['Timestamp', 'Call sign'], ['11/5/2020 20:00:00', 'K1WCC']]
+
+
+@pytest.fixture
+def fetcher():
+    fetcher = AsyncSheetFetcher(max_concurrency=2, retries=2, backoff=0, timeout=5)
+    yield fetcher
+    fetcher.close()
+
+
+def test_values_are_returned(sheet_server, fetcher):
+    sheet_server.respond('/a', (200, {}, VALUES))
+
+    assert fetcher.fetch_all({'a': sheet_server.url('/a')}) == {'a': VALUES}
+
+
+def test_not_modified_returns_the_cached_values(sheet_server, fetcher):
+    sheet_server.respond('/a', (200, {'ETag': '"v1"'}, VALUES), (304, {'ETag': '"v1"'}, b''))
+    url = sheet_server.url('/a')
+
+    assert fetcher.fetch_all({'a': url})['a'] == VALUES
+    assert fetcher.fetch_all({'a': url})['a'] == VALUES
+
+    first, second = [headers for command, path, headers in sheet_server.requests]
+    assert 'If-None-Match' not in first
+    assert second['If-None-Match'] == '"v1"'
+
+
+def test_server_errors_are_retried(sheet_server, fetcher):
+    sheet_server.respond('/a', (503, {}, b''), (500, {}, b''), (200, {}, VALUES))
+
+    assert fetcher.fetch_all({'a': sheet_server.url('/a')})['a'] == VALUES
+    assert sheet_server.count('/a') == 3
+
+
+def test_retries_give_up(sheet_server, fetcher):
+    sheet_server.respond('/a', (503, {}, b''))
+
+    result = fetcher.fetch_all({'a': sheet_server.url('/a')})['a']
+    assert isinstance(result, FetchError)
+    assert sheet_server.count('/a') == fetcher.retries + 1
+
+
+def test_client_errors_are_not_retried(sheet_server, fetcher):
+    sheet_server.respond('/a', (404, {}, b''))
+
+    assert isinstance(fetcher.fetch_all({'a': sheet_server.url('/a')})['a'], FetchError)
+    assert sheet_server.count('/a') == 1
+
+
+def test_non_json_body_is_a_fetch_error(sheet_server, fetcher):
+    sheet_server.respond('/a', (200, {}, VALUES))
+    sheet_server.respond('/b', (200, {'Content-Type': 'text/html'}, b'<html>quota exceeded</html>'))
+    received = []
+
+    results = fetcher.fetch_all({'a': sheet_server.url('/a'), 'b': sheet_server.url('/b')},
+                                on_result=lambda name, values: received.append(name))
+
+    assert results['a'] == VALUES
+    assert isinstance(results['b'], FetchError)
+    assert received == ['a']
+
+
+def test_fetch_all_inside_a_running_loop(sheet_server, fetcher):
+    sheet_server.respond('/a', (200, {}, VALUES))
+
+    async def notebook_cell():
+        return fetcher.fetch_all({'a': sheet_server.url('/a')})
+
+    assert asyncio.run(notebook_cell()) == {'a': VALUES}
+
+
+def test_fetch_all_async(sheet_server, fetcher):
+    sheet_server.respond('/a', (200, {}, VALUES))
+    sheet_server.respond('/b', (404, {}, b''))
+    received = []
+
+    async def fetch():
+        return await fetcher.fetch_all_async({'a': sheet_server.url('/a'), 'b': sheet_server.url('/b')},
+                                             on_result=lambda name, values: received.append(name))
+
+    results = asyncio.run(fetch())
+    assert results['a'] == VALUES
+    assert isinstance(results['b'], FetchError)
+    assert received == ['a']
@@ -0,0 +1,85 @@
+"""the job runner's steps and benchmarks"""
+import os
+import glob
+import tempfile
+import configparser
+
+import pytest
+
+from simplex_jobs import JobRunner
+from simplex_net import SimplexReportDatabase
+
+
+def make_config(report_db, tmp_path, **render):
+    config = configparser.ConfigParser()
+    config.read_dict({'database': {'filename': report_db.report_database_filename},
+                      'render': dict({'frequencies': '146.58', 'site_dir': str(tmp_path / 'site'),
+                                      'coverage_cache_dir': str(tmp_path / 'coverage')}, **render)})
+    return config
+
+
+def test_bench_leaves_the_coverage_cache_alone(report_db, tmp_path):
+    report_db.get_coverage_grid('W1FX', 146.58)
+    cached = sorted(glob.glob(str(tmp_path / 'coverage' / 'coverage_*.npz')))
+    assert len(cached) == 1
+
+    JobRunner(make_config(report_db, tmp_path)).bench(repeat=1)
+
+    assert sorted(glob.glob(str(tmp_path / 'coverage' / 'coverage_*.npz'))) == cached
+    assert os.path.exists(cached[0])
+
+
+def test_bench_cleans_up_its_site_bundles(report_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path / 'scratch'))
+    os.mkdir(tempfile.tempdir)
+
+    JobRunner(make_config(report_db, tmp_path)).bench(repeat=2)
+
+    assert os.listdir(tempfile.tempdir) == []
+
+
+@pytest.fixture
+def drawn_pages(monkeypatch):
+    """the Bokeh pages drawn, as (frequency, net date)"""
+    drawn = []
+
+    def plot_all_stations_to_html(db, frequency, net_date=None, html_path='index.html', show_plots=True):
+        drawn.append((frequency, net_date))
+        with open(html_path, 'w') as fp:
+            fp.write('<html></html>')
+
+    monkeypatch.setattr(SimplexReportDatabase, 'plot_all_stations_to_html', plot_all_stations_to_html)
+    return drawn
+
+
+def test_render_redraws_only_the_changed_nets(report_db, tmp_path, drawn_pages):
+    config = make_config(report_db, tmp_path, dates='11/5/2020, 11/19/2020', bokeh_pages='true')
+    JobRunner(config).run('render')
+    assert sorted(drawn_pages, key=str) == sorted([(146.58, None), (146.58, '11/5/2020'), (146.58, '11/19/2020')],
+                                                  key=str)
+
+    # written behind the rollup's back, as another tool or a hand edit would
+    report_db.con.execute("DELETE FROM RESPONSES WHERE DateOfNet='11/5/2020' AND TransmittingStation='K1WCC'")
+    report_db.con.commit()
+    before = report_db.get_station_statistics(frequency=146.58, net_date='11/19/2020')
+    drawn_pages.clear()
+
+    JobRunner(config).run('render')
+
+    assert sorted(drawn_pages, key=str) == sorted([(146.58, None), (146.58, '11/5/2020')], key=str)
+    statistics = report_db.get_station_statistics(frequency=146.58, net_date='11/5/2020')
+    assert 'K1WCC' not in set(statistics['TransmittingStation'])
+    assert report_db.get_station_statistics(frequency=146.58, net_date='11/19/2020').equals(before)
+
+    drawn_pages.clear()
+    JobRunner(config).run('render')
+    assert drawn_pages == []
+
+
+def test_new_render_settings_redraw_everything(report_db, tmp_path, drawn_pages):
+    JobRunner(make_config(report_db, tmp_path, dates='11/5/2020', bokeh_pages='true')).run('render')
+    drawn_pages.clear()
+
+    JobRunner(make_config(report_db, tmp_path, dates='11/5/2020, 11/19/2020', bokeh_pages='true')).run('render')
+
+    assert len(drawn_pages) == 3
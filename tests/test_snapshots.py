@@ -0,0 +1,78 @@
+"""snapshots and restoring them into an open report database"""
+import sqlite3
+
+import snapshots
+
+from conftest import CALLS, LOCATIONS
+
+
+def write_old_database(file_name):
+    """a report database as written before NetDay, NET_METADATA and NET_STATISTICS"""
+    con = sqlite3.connect(file_name)
+    con.execute("CREATE TABLE Hams (Id INT, Call TINYTEXT, Latitude FLOAT, Longitude FLOAT)")
+    con.executemany("INSERT INTO Hams VALUES (?, ?, ?, ?)",
+                    [(i, call, latitude, longitude) for i, (call, (latitude, longitude))
+                     in enumerate(zip(CALLS, LOCATIONS))])
+    con.execute("CREATE TABLE RESPONSES (Id TEXT, ReportingTimestamp DATETIME, ReportingStation TINYTEXT, " +
+                "DateOfNet DATE, FrequencyOfNet FLOAT, " +
+                "TransmittingStation TINYTEXT, TransmittingStationPower FLOAT, TransmittingStationHeight FLOAT, " +
+                "TransmittingStationLatitude FLOAT, TransmittingStationLongitude FLOAT, " +
+                "ReceivingStation TINYTEXT, QSOQuality TINYTEXT, ReceivingStationHeight TINYTEXT, " +
+                "ReceivingStationLatitude FLOAT, ReceivingStationLongitude FLOAT)")
+    con.executemany("INSERT INTO RESPONSES VALUES (?, '01/07/2021 20:00:00', ?, '01/07/2021', 146.58, ?, " +
+                    "'50', '100', 42.55, -70.9, ?, 'G/R', '100', 42.6, -71.0)",
+                    [(f'{i}', CALLS[1], CALLS[0], CALLS[1]) for i in range(3)])
+    con.commit()
+    con.close()
+
+
+def test_restore_an_old_snapshot(report_db, tmp_path):
+    old_file_name = str(tmp_path / 'old_backup.db')
+    write_old_database(old_file_name)
+    report_db.get_relay_graph(146.58)
+    assert len(report_db.relay_graph_cache) == 1
+
+    report_db.restore_snapshot(old_file_name)
+
+    assert report_db.relay_graph_cache == {}
+    assert report_db.list_net_dates(146.58) == ['1/7/2021']
+    assert len(report_db.get_one_ham_reception_data('K1WCC', 146.58, '1/7/2021')) == 3
+    statistics = report_db.get_station_statistics('K1WCC', 146.58)
+    assert list(statistics['GoodCount']) == [3]
+
+
+def test_unchanged_database_is_not_copied_again(report_db, monkeypatch):
+    first = report_db.create_snapshot()
+    copies = []
+    monkeypatch.setattr(snapshots, 'copy_database', lambda *args, **kwargs: copies.append(args))
+
+    assert report_db.create_snapshot() == first
+    assert copies == []
+
+
+def test_writes_in_the_write_ahead_log_are_a_change(report_db):
+    report_db.con.execute("PRAGMA journal_mode=WAL")
+    first = report_db.create_snapshot()
+    report_db.con.execute("DELETE FROM RESPONSES WHERE ReportingStation='K1WCC'")
+    report_db.con.commit()
+
+    second = report_db.create_snapshot(compress=True)
+    assert second != first
+    assert second.endswith('.gz')
+    assert report_db.create_snapshot(compress=True) == second
+
+
+def test_forced_snapshots_in_the_same_second_are_kept(report_db):
+    names = [report_db.create_snapshot(force=True, keep_last=10) for i in range(4)]
+
+    assert len(set(names)) == 4
+    assert [file_name for when, file_name in report_db.list_snapshots()] == names
+
+
+def test_retention_leaves_older_copies_alone(report_db, tmp_path):
+    (tmp_path / 'snapshots').mkdir()
+    old_copy = str(tmp_path / 'snapshots' / 'reports.db20200101120000')
+    write_old_database(old_copy)
+    names = [report_db.create_snapshot(force=True, keep_last=2, keep_daily=0, keep_monthly=0) for i in range(4)]
+
+    assert [file_name for when, file_name in report_db.list_snapshots()] == [old_copy] + names[-2:]
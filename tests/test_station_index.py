@@ -0,0 +1,47 @@
+"""StationIndex lookups against a brute force search"""
+import numpy as np
+import pytest
+
+from station_index import StationIndex, haversine_array
+
+
+@pytest.fixture
+def stations():
+    rng = np.random.default_rng(7)
+    latitudes = np.concatenate([rng.uniform(41.5, 43.5, 300), rng.uniform(60, 75, 50)])
+    longitudes = np.concatenate([rng.uniform(-72.5, -69.5, 300), rng.uniform(-170, 170, 50)])
+    return [f'W{n}' for n in range(len(latitudes))], latitudes, longitudes
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+def test_nearest_matches_brute_force(stations, k):
+    calls, latitudes, longitudes = stations
+    index = StationIndex(calls, latitudes, longitudes, cell_size=0.25)
+    rng = np.random.default_rng(k)
+    points = np.column_stack([rng.uniform(30, 80, 200), rng.uniform(-180, 180, 200)])
+    points[:50] = np.column_stack([rng.uniform(41.5, 43.5, 50), rng.uniform(-72.5, -69.5, 50)])
+
+    nearest_calls, nearest_distances = index.nearest(points[:, 0], points[:, 1], k=k)
+
+    distances = haversine_array(points[:, 0, None], points[:, 1, None], latitudes[None, :], longitudes[None, :])
+    expected = np.sort(distances, axis=1)[:, :k]
+    np.testing.assert_allclose(nearest_distances, expected)
+    assert nearest_calls.shape == (len(points), k)
+
+
+def test_nearest_without_a_location(stations):
+    index = StationIndex(*stations)
+
+    nearest_calls, nearest_distances = index.nearest([np.nan, 42.5], [-71.0, np.nan], k=2)
+
+    assert (nearest_calls == None).all()  # noqa: E711
+    assert np.isnan(nearest_distances).all()
+
+
+def test_nearest_with_more_neighbours_than_stations():
+    index = StationIndex(['K1WCC', 'W1FX'], [42.55, 42.6], [-70.9, -71.0])
+
+    nearest_calls, nearest_distances = index.nearest(42.55, -70.9, k=5)
+
+    assert nearest_calls.tolist() == [['K1WCC', 'W1FX']]
+    assert nearest_distances[0, 0] == 0
@@ -0,0 +1,13 @@
+"""station images drawn without a browser"""
+import os
+
+import pytest
+
+
+@pytest.mark.parametrize('image_format', ['svg', 'png'])
+def test_thumbnails_with_the_frequency_as_text(report_db, tmp_path, image_format):
+    files = report_db.export_station_thumbnails('146.58', '11/5/2020', out_dir=str(tmp_path / 'thumbnails'),
+                                                image_format=image_format)
+
+    assert len(files) == 4
+    assert all(os.path.exists(file_name) and '_146.580_' in file_name for file_name in files.values())
@@ -0,0 +1,167 @@
+"""thumbnails module
+
+    Static station reception images without a browser.
+
+    Bokeh's export_png drives a headless browser for every figure.  Here the
+    same picture as plot_station_reception - station dots, reception circles
+    sized by quality and the transmitting station marker - is drawn straight
+    onto a basemap image with Pillow, or written as SVG.  The basemap is
+    stitched from OpenStreetMap tiles once per map extent and image size and
+    kept on disk, so a whole net's thumbnails take seconds.
+
+"""
+import os
+import io
+import math
+import html
+import urllib.request
+
+from PIL import Image, ImageDraw
+
+TILE_URL = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+TILE_SIZE = 256
+WEB_MERCATOR_HALF_WORLD = math.pi * 6378137
+
+
+def to_pixels(x, y, extent, size):
+    """web mercator meters to image pixels"""
+    x_min, x_max, y_min, y_max = extent
+    width, height = size
+
+    return (x - x_min) / (x_max - x_min) * width, (y_max - y) / (y_max - y_min) * height
+
+
+def fetch_tile(z, x, y, tile_url=TILE_URL, timeout=10):
+    request = urllib.request.Request(tile_url.format(z=z, x=x, y=y),
+                                     headers={'User-Agent': 'simplex_net thumbnails'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return Image.open(io.BytesIO(response.read())).convert('RGB')
+
+
+def stitch_basemap(extent, size, tile_url=TILE_URL):
+    """basemap image for a web mercator extent from map tiles, None if the tiles cannot be fetched"""
+    x_min, x_max, y_min, y_max = extent
+    width, height = size
+
+    meters_per_pixel = (x_max - x_min) / width
+    zoom = max(0, min(19, math.ceil(math.log2(2 * WEB_MERCATOR_HALF_WORLD / (TILE_SIZE * meters_per_pixel)))))
+    tile_meters = 2 * WEB_MERCATOR_HALF_WORLD / 2 ** zoom
+
+    i_min = int((x_min + WEB_MERCATOR_HALF_WORLD) // tile_meters)
+    i_max = int((x_max + WEB_MERCATOR_HALF_WORLD) // tile_meters)
+    j_min = int((WEB_MERCATOR_HALF_WORLD - y_max) // tile_meters)
+    j_max = int((WEB_MERCATOR_HALF_WORLD - y_min) // tile_meters)
+
+    mosaic = Image.new('RGB', ((i_max - i_min + 1) * TILE_SIZE, (j_max - j_min + 1) * TILE_SIZE), (230, 230, 230))
+    try:
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                mosaic.paste(fetch_tile(zoom, i, j, tile_url), ((i - i_min) * TILE_SIZE, (j - j_min) * TILE_SIZE))
+    except OSError as er:
+        print(f'map tiles not available ({er}), using a plain background')
+        return None
+
+    # crop the mosaic to the extent, then scale it to the image size
+    scale = TILE_SIZE / tile_meters
+    left = (x_min + WEB_MERCATOR_HALF_WORLD - i_min * tile_meters) * scale
+    top = (WEB_MERCATOR_HALF_WORLD - y_max - j_min * tile_meters) * scale
+    right = left + (x_max - x_min) * scale
+    bottom = top + (y_max - y_min) * scale
+
+    return mosaic.crop((round(left), round(top), round(right), round(bottom))).resize(size, Image.LANCZOS)
+
+
+def basemap_file_name(extent, size, cache_dir):
+    return os.path.join(cache_dir, 'basemap_%d_%d_%d_%d_%dx%d.png' % (tuple(extent) + tuple(size)))
+
+
+def load_basemap(extent, size, cache_dir, tile_url=TILE_URL):
+    """the basemap for an extent and size, stitched once and then read from cache_dir
+
+    Without map tiles a plain background is returned and nothing is cached, so the next call tries again.
+    """
+    file_name = basemap_file_name(extent, size, cache_dir)
+    if os.path.exists(file_name):
+        return Image.open(file_name).convert('RGB')
+
+    basemap = stitch_basemap(extent, size, tile_url)
+    if basemap is None:
+        return Image.new('RGB', tuple(size), (230, 230, 230))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    basemap.save(file_name)
+
+    return basemap
+
+
+def render_png(basemap, extent, stations, reception, transmitter, title=None):
+    """draw one station's reception on a copy of the basemap
+
+    :param basemap: PIL image
+    :param tuple extent: (x_min, x_max, y_min, y_max) web mercator
+    :param stations: (x, y) of every station
+    :param reception: (x, y, radius in meters) of each receiving station, radius 0 or None draws nothing
+    :param transmitter: (x, y) of the transmitting station, None if unknown
+    :param str title: text for the top left corner
+    :return: PIL image
+    """
+    image = basemap.copy()
+    draw = ImageDraw.Draw(image)
+    size = image.size
+    pixels_per_meter = size[0] / (extent[1] - extent[0])
+
+    for x, y in stations:
+        px, py = to_pixels(x, y, extent, size)
+        draw.ellipse((px - 2, py - 2, px + 2, py + 2), fill=(0, 0, 0))
+
+    for x, y, radius in reception:
+        if radius is None or radius <= 0 or x is None:
+            continue
+        px, py = to_pixels(x, y, extent, size)
+        r = max(radius * pixels_per_meter, 3)
+        draw.ellipse((px - r, py - r, px + r, py + r), outline=(0, 128, 0), width=2)
+
+    if transmitter is not None:
+        px, py = to_pixels(transmitter[0], transmitter[1], extent, size)
+        for dx, dy in [(6, 0), (0, 6), (4, 4), (4, -4)]:
+            draw.line((px - dx, py - dy, px + dx, py + dy), fill=(0, 0, 255), width=2)
+
+    if title is not None:
+        box = draw.textbbox((4, 4), title)
+        draw.rectangle((box[0] - 2, box[1] - 2, box[2] + 2, box[3] + 2), fill=(255, 255, 255))
+        draw.text((4, 4), title, fill=(0, 0, 0))
+
+    return image
+
+
+def render_svg(basemap_href, extent, size, stations, reception, transmitter, title=None):
+    """the same drawing as render_png as SVG text, the basemap referenced by file name or URL"""
+    width, height = size
+    pixels_per_meter = width / (extent[1] - extent[0])
+
+    parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}">']
+    if basemap_href is not None:
+        parts.append(f'<image href="{basemap_href}" x="0" y="0" width="{width}" height="{height}"/>')
+
+    for x, y in stations:
+        px, py = to_pixels(x, y, extent, size)
+        parts.append(f'<circle cx="{px:.1f}" cy="{py:.1f}" r="2" fill="black"/>')
+
+    for x, y, radius in reception:
+        if radius is None or radius <= 0 or x is None:
+            continue
+        px, py = to_pixels(x, y, extent, size)
+        r = max(radius * pixels_per_meter, 3)
+        parts.append(f'<circle cx="{px:.1f}" cy="{py:.1f}" r="{r:.1f}" fill="none" stroke="green" '
+                     f'stroke-width="2"/>')
+
+    if transmitter is not None:
+        px, py = to_pixels(transmitter[0], transmitter[1], extent, size)
+        parts.append(f'<text x="{px - 5:.1f}" y="{py + 8:.1f}" fill="blue" font-size="20">*</text>')
+
+    if title is not None:
+        parts.append(f'<text x="4" y="14" font-size="12" font-family="sans-serif">{html.escape(title)}</text>')
+
+    parts.append('</svg>')
+
+    return '\n'.join(parts)